@@ -6,12 +6,12 @@
 # @Software: PyCharm
 # @Notice  : Excel file placeholder replacement while preserving formatting
 
-import os
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-import re
 import time
 
+from openpyxl import load_workbook
+
+from template_scanner import scan_templates
+
 
 class ExcelReplace:
     """
@@ -79,14 +79,7 @@ class ExcelReplace:
         """
         Get list of Excel files in directory and subdirectories
         """
-        file_list = []
-        for roots, dirs, files in os.walk(dir_path):
-            for file in files:
-                # Find Excel documents and exclude temporary files
-                if (file.endswith(".xlsx") or file.endswith(".xls")) and file[0] != "~":
-                    file_root = os.path.join(roots, file)
-                    file_list.append(file_root)
-        return file_list
+        return [f.path for f in scan_templates(dir_path).excel_files()]
 
     def replace_excel(self, replace_dict):
         """
@@ -8,8 +8,9 @@
 
 
 from docx import Document
-import os
-import re
+from docx.oxml.ns import qn
+
+from template_scanner import scan_templates
 
 
 class OptimizedExecute:
@@ -198,14 +199,7 @@ class OptimizedWordReplace:
     @staticmethod
     def docx_list(dirPath):
         """Get list of docx files in directory and subdirectories"""
-        file_list = []
-        for roots, dirs, files in os.walk(dirPath):
-            for file in files:
-                # Find the docx document and exclude temporary files
-                if file.endswith("docx") and file[0] != "~":
-                    file_root = os.path.join(roots, file)
-                    file_list.append(file_root)
-        return file_list
+        return [f.path for f in scan_templates(dirPath).word_files()]
 
     def replace_doc(self, replace_dict: dict):
         """Optimized document replacement - processes all sections efficiently"""
@@ -224,6 +218,45 @@ class OptimizedWordReplace:
         return self.docx
 
 
+class CompiledWordReplace(OptimizedWordReplace):
+    """
+    Direct run substitution for templates produced by template_compiler.py
+    file: compiled .docx file
+    locations: {part name: [[run index, [placeholders]], ...]}
+    """
+
+    def __init__(self, file, locations):
+        super().__init__(file)
+        self.locations = locations
+
+    def replace_doc(self, replace_dict: dict):
+        """Substitute placeholders in the runs recorded at compile time"""
+        if not replace_dict:
+            return self.docx
+
+        parts = {
+            str(part.partname): part
+            for part in self.docx.part.package.iter_parts()
+            if str(part.partname) in self.locations
+        }
+        for partname, run_locations in self.locations.items():
+            part = parts.get(partname)
+            if part is None:
+                continue
+            runs = list(part.element.iter(qn("w:r")))
+            for run_index, placeholders in run_locations:
+                keys = [key for key in placeholders if key in replace_dict]
+                if not keys:
+                    continue
+                for text_element in runs[run_index].iter(qn("w:t")):
+                    text = text_element.text or ""
+                    for key in keys:
+                        text = text.replace(key, replace_dict[key])
+                    text_element.text = text
+
+        return self.docx
+
+
 # Backward compatibility - keep the old class names
 class Execute(OptimizedExecute):
     """Backward compatibility wrapper"""
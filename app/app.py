@@ -1,67 +1,14 @@
 import os
 import streamlit as st
-from tqdm import tqdm
-import concurrent.futures
-import pandas as pd
 import time
-import shutil
-import gc
-
-from Replacer import WordReplace
-from ExcelReplacer import ExcelReplace
-from pdf_extractor import PDFExtractor, validate_pdf_file
-from utils import (
-    zip_folder, create_mapping_dict, set_date_and_place,
-    replace_text, replace_first_image_in_header
-)
-
-
-def process_word_document(args):
-    """
-    Process a single Word document - designed for parallel execution
-    """
-    file_path, mapping_dict, logo_path, template_folder_path, output_folder_path = args
-
-    try:
-        wordreplace = WordReplace(file_path)
-        wordreplace.replace_doc(mapping_dict)
-        doc = wordreplace.docx
-        set_date_and_place(doc)
-
-        if logo_path and os.path.exists(logo_path):
-            replace_first_image_in_header(doc, logo_path)
-
-        doc_name = f"{os.path.basename(file_path)}"
-        rel_path = os.path.relpath(file_path, template_folder_path)
-        path_to_save = os.path.join(output_folder_path, rel_path)
-        path_to_save = path_to_save.replace(
-            os.path.basename(file_path), doc_name)
-        doc.save(path_to_save)
-        return True, file_path
-    except Exception as e:
-        return False, f"Error processing {os.path.basename(file_path)}: {str(e)}"
-
-
-def process_excel_document(args):
-    """
-    Process a single Excel document - designed for parallel execution
-    """
-    file_path, mapping_dict, template_folder_path, output_folder_path = args
-
-    try:
-        excel_replace = ExcelReplace(file_path)
-        excel_replace.replace_excel(mapping_dict)
-        excel_replace.set_date_and_place()
-
-        excel_name = f"{os.path.basename(file_path)}"
-        rel_path = os.path.relpath(file_path, template_folder_path)
-        path_to_save = os.path.join(output_folder_path, rel_path)
-        path_to_save = path_to_save.replace(
-            os.path.basename(file_path), excel_name)
-        excel_replace.save(path_to_save)
-        return True, file_path
-    except Exception as e:
-        return False, f"Error processing {os.path.basename(file_path)}: {str(e)}"
+
+from template_scanner import scan_templates
+from scheduling import available_cores, default_worker_count, get_timing_history
+from workspace import get_workspace_manager
+from utils import DEFAULT_COMPRESSLEVEL
+
+# pandas, the document libraries (via generation) and the PDF tooling are
+# imported where each feature is used, so a session only loads what it needs
 
 
 # Create the Streamlit app
@@ -88,31 +35,74 @@ def main():
         logo = st.sidebar.file_uploader(
             "Uploader votre logo", type=["png", "jpg", "jpeg"])
 
+        if os.path.exists("templates"):
+            template_folder_path = "templates"
+        else:
+            template_folder_path = "app/templates"
+
+        # Worker count suggested from the cores and the measured template costs
+        inventory = scan_templates(template_folder_path)
+        max_worker_choice = max(8, available_cores())
+        recommended_workers = default_worker_count(
+            inventory.word_files() + inventory.excel_files(),
+            get_timing_history(template_folder_path), max_worker_choice)
+
         # Performance configuration
         st.sidebar.title("Configuration Performance :gear:")
         use_parallel = st.sidebar.checkbox("Utiliser le traitement parallèle", value=True,
                                            help="Active le traitement parallèle pour améliorer les performances")
         max_workers = st.sidebar.slider("Nombre de workers parallèles", min_value=1,
-                                        max_value=8, value=4, help="Nombre de documents traités simultanément")
+                                        max_value=max_worker_choice, value=recommended_workers,
+                                        help="Nombre de documents traités simultanément (valeur suggérée selon les coeurs disponibles et les temps mesurés)")
+        compresslevel = st.sidebar.slider("Niveau de compression du zip", min_value=1,
+                                          max_value=9, value=DEFAULT_COMPRESSLEVEL,
+                                          help="Les fichiers déjà compressés (docx, xlsx, images) sont stockés tels quels")
+        # Top-level folders (Indicateur_*), empty selection generates everything
+        indicator_folders = [d for d in inventory.directories if os.sep not in d]
+        selected_indicators = st.sidebar.multiselect(
+            "Indicateurs à générer", indicator_folders,
+            help="Laisser vide pour tout générer. Une colonne \"Indicateurs\" du fichier client (ex: 1, 5, 7) restreint la sélection par client")
+
+        profile_run = st.sidebar.checkbox("Profiler la génération", value=False,
+                                          help="Mesure où le temps est passé pendant la génération (ralentit légèrement le traitement)")
 
         if not excel:
             st.warning("Veuillez uploader un fichier excel pour commencer.")
 
         if excel:
+            # Each session works in its own directory (tmpfs when available)
+            workspace_manager = get_workspace_manager()
+            if "workspace_id" not in st.session_state:
+                st.session_state["workspace_id"] = workspace_manager.new_session_id()
+            workspace_id = st.session_state["workspace_id"]
+            workspace_path = workspace_manager.workspace(workspace_id)
+            logo_path = os.path.join(workspace_path, "logo.png")
 
             if logo is not None:
-                # Save the uploaded file to the current directory
-                with open("logo.png", "wb") as f:
+                # Save the uploaded file to the session workspace
+                with open(logo_path, "wb") as f:
                     f.write(logo.getvalue())
 
-            df = pd.read_excel(excel)
-            df = df.astype(str)
+            import pandas as pd
+
+            from record_store import ClientRecordStore
+
+            raw_df = pd.read_excel(excel)
+            # Normalised once, mapping dicts are then built from the store
+            records = ClientRecordStore.from_dataframe(raw_df)
+            # Blank cells stay empty instead of becoming "nan" in the documents
+            df = raw_df.fillna("").astype(str)
 
             st.sidebar.write(df.iloc[:, 1:].tail(7))
 
+            # Row 0 holds the placeholders, clients start at 1
+            if len(df) < 2:
+                st.warning("Le fichier ne contient aucun client: ajoutez au moins une ligne sous la ligne des champs.")
+                st.stop()
+
             row_index = st.number_input(
                 "Entrer l'indice de ligne prévisualisé à gauche",
-                min_value=0,
+                min_value=1,
                 max_value=len(df) - 1,
                 step=1,
             )
@@ -123,132 +113,112 @@ def main():
                 ]
                 st.write(row_data)
 
-            if os.path.exists("templates"):
-                template_folder_path = "templates"
-            else:
-                template_folder_path = "app/templates"
+            with st.expander("Aperçu d'un document"):
+                from preview import PREVIEW_EXTENSIONS, render_preview
+
+                template_names = [f.rel_path for f in inventory.word_files() + inventory.excel_files()
+                                  if f.rel_path.lower().endswith(PREVIEW_EXTENSIONS)]
+                preview_name = st.selectbox("Modèle", template_names)
+                if preview_name:
+                    # The body of a collapsed expander still runs: an unreadable
+                    # template must not stop the rest of the page
+                    try:
+                        preview = render_preview(template_folder_path, preview_name,
+                                                 records.mapping(row_index))
+                    except Exception as e:
+                        st.warning(f"Aperçu impossible pour {preview_name}: {str(e)}")
+                    else:
+                        if preview.unresolved:
+                            st.warning("Champs non remplis: " + ", ".join(preview.unresolved))
+                        st.caption(f"Aperçu calculé en {preview.seconds * 1000:.0f} ms")
+                        st.markdown(preview.html, unsafe_allow_html=True)
 
             if st.button("Générer les documents") and template_folder_path:
-                start_time = time.time()
+                from generation import client_folders, generate_dossier
 
                 nom_organisme = df.iloc[row_index]["Nom de l'organisme"]
                 # Create a folder to store generated documents
-                output_folder_path = f"docs/{nom_organisme}_{time.strftime('%H_%M_%S')}"
-                # Copy template structure (now including Excel files)
-                shutil.copytree(
-                    template_folder_path,
-                    output_folder_path,
-                    ignore=shutil.ignore_patterns("*.docx"),
-                )
-
-                mappings = create_mapping_dict(df)
-
-                mapping_dict = {
-                    key: str(df.iloc[row_index][value]) for key, value in mappings.items()
-                }
+                dossier_name = f"{nom_organisme}_{time.strftime('%H_%M_%S')}"
+                output_folder_path = os.path.join(workspace_path, dossier_name)
+
+                mapping_dict = records.mapping(row_index)
+                try:
+                    folders = client_folders(template_folder_path, records.record(row_index),
+                                             selected_indicators)
+                except ValueError as e:
+                    st.error(f"Sélection d'indicateurs invalide: {str(e)}")
+                    st.stop()
+                selected_inventory = scan_templates(template_folder_path, folders)
 
                 progress_bar = st.progress(0, text=f"Progress: 0%")
 
-                # Process both Word and Excel documents
-                doc_list = WordReplace.docx_list(template_folder_path)
-                excel_list = ExcelReplace.excel_list(template_folder_path)
-                total_files = len(doc_list) + len(excel_list)
-
                 st.info(
-                    f"Traitement de {len(doc_list)} documents Word et {len(excel_list)} documents Excel")
-
-                file_counter = 0
-
-                # Process Word documents
-                if use_parallel and len(doc_list) > 1:
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                        futures = [
-                            executor.submit(process_word_document, (file, mapping_dict,
-                                            "logo.png" if logo is not None else None, template_folder_path, output_folder_path))
-                            for file in doc_list
-                        ]
-                        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-                            file_counter += 1
-                            progress_bar.progress(
-                                file_counter / total_files,
-                                text=f"Document Word {file_counter}/{total_files}",
-                            )
-                            success, result = future.result()
-                            if not success:
-                                # result contains the error message
-                                st.warning(result)
-                            # Force garbage collection to free memory
-                            gc.collect()
-                else:
-                    # Sequential processing for small document sets or when parallel is disabled
-                    for i, file in tqdm(enumerate(doc_list)):
-                        file_counter += 1
-                        progress_bar.progress(
-                            file_counter / total_files,
-                            text=f"Document Word {file_counter}/{total_files}",
-                        )
-                        success, result = process_word_document(
-                            (file, mapping_dict, "logo.png" if logo is not None else None, template_folder_path, output_folder_path))
-                        if not success:
-                            st.warning(result)
-                        gc.collect()
-
-                # Process Excel documents (new feature)
-                if use_parallel and len(excel_list) > 1:
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                        futures = [
-                            executor.submit(
-                                process_excel_document, (file, mapping_dict, template_folder_path, output_folder_path))
-                            for file in excel_list
-                        ]
-                        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-                            file_counter += 1
-                            progress_bar.progress(
-                                file_counter / total_files,
-                                text=f"Document Excel {file_counter}/{total_files}",
-                            )
-                            success, result = future.result()
-                            if not success:
-                                # result contains the error message
-                                st.warning(result)
-                            # Force garbage collection to free memory
-                            gc.collect()
-                else:
-                    # Sequential processing for small document sets or when parallel is disabled
-                    for i, file in tqdm(enumerate(excel_list)):
-                        file_counter += 1
-                        progress_bar.progress(
-                            file_counter / total_files,
-                            text=f"Document Excel {file_counter}/{total_files}",
-                        )
-                        success, result = process_excel_document(
-                            (file, mapping_dict, template_folder_path, output_folder_path))
-                        if not success:
-                            st.warning(result)
-                        gc.collect()
-
-                zip_folder(output_folder_path, output_folder_path + ".zip")
+                    f"Traitement de {len(selected_inventory.word_files())} documents Word et {len(selected_inventory.excel_files())} documents Excel")
 
-                end_time = time.time()
-                processing_time = end_time - start_time
+                def on_progress(file_counter, total_files, kind, success, result):
+                    progress_bar.progress(
+                        file_counter / total_files,
+                        text=f"Document {kind} {file_counter}/{total_files}",
+                    )
+                    if not success:
+                        st.warning(result)
+
+                profiler = None
+                if profile_run:
+                    from profiling import RunProfiler
+
+                    profiler = RunProfiler().start()
+                try:
+                    result = generate_dossier(
+                        template_folder_path, mapping_dict, output_folder_path,
+                        logo_path=logo_path if logo is not None else None,
+                        use_parallel=use_parallel, max_workers=max_workers,
+                        compresslevel=compresslevel, progress_callback=on_progress,
+                        profiler=profiler, folders=folders,
+                    )
+                finally:
+                    if profiler is not None:
+                        profiler.stop()
+                total_files = result["total_files"]
+                processing_time = result["seconds"]
+                zip_stats = result["zip_stats"]
+                workspace_manager.enforce_quota(
+                    workspace_id, keep={dossier_name, dossier_name + ".zip", "logo.png"})
 
                 st.success(
-                    f"Documents générés en {processing_time:.2f} secondes ! Dossier: {output_folder_path}")
+                    f"Documents générés en {processing_time:.2f} secondes ! Dossier: {dossier_name}")
                 st.info(
                     f"Performance: {total_files/processing_time:.2f} documents/seconde")
+                stage_seconds = result["stage_seconds"]
+                st.info(
+                    "Étapes (temps cumulé des workers): "
+                    + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in stage_seconds.items()))
+                st.info(
+                    f"Archive: {zip_stats['files']} fichiers compressés en {zip_stats['seconds']:.2f} secondes "
+                    f"({zip_stats['compressed_bytes'] / 1024:.0f} Ko, ratio {zip_stats['ratio']:.0%})")
+
+                if profiler is not None:
+                    st.subheader("Profil de la génération")
+                    st.dataframe(pd.DataFrame(profiler.top_functions(15)),
+                                 use_container_width=True, hide_index=True)
+                    st.download_button(
+                        label="Télécharger le profil (pstats + collapsed stacks)",
+                        data=profiler.artifact_bytes(),
+                        file_name=f"{dossier_name}_profile.zip",
+                        mime="application/zip",
+                    )
 
                 with open(output_folder_path + ".zip", "rb") as f:
                     st.download_button(
                         label="Télécharger le dossier des documents générés",
                         data=f,
-                        file_name=output_folder_path + ".zip",
+                        file_name=dossier_name + ".zip",
                         mime="application/zip",
                     )
 
             if st.button("Supprimer le dossier généré"):
-                if os.path.exists("docs"):
-                    shutil.rmtree("docs")
-                    # print("Folder deleted")
+                # Only this session's workspace, other users' runs are untouched
+                workspace_manager.release(workspace_id)
 
     # PDF Information Extraction Tab
     with tab2:
@@ -264,6 +234,9 @@ def main():
         )
 
         if uploaded_pdf is not None:
+            import pandas as pd
+            from pdf_extractor import PDFExtractor, validate_pdf_file
+
             # Validate PDF file
             if not validate_pdf_file(uploaded_pdf):
                 st.error("Veuillez sélectionner un fichier PDF valide (max 50MB)")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : batch.py
+# @Notice  : Batch generation of dossiers for every client of a sheet
+
+"""
+Generate one dossier per client row of a large CSV/XLSX export.
+
+Rows are streamed from the sheet (see ingestion.py) and each dossier is
+submitted as soon as its row is parsed. At most `parallel_dossiers` dossiers
+are generated at once and only as many rows are read ahead, so memory does
+not grow with the size of the sheet.
+
+For repeated runs over the same sheet, use_record_store reads the rows from
+its cached column store (see record_store.py) instead of parsing it again.
+
+Runs keep a completion journal in the output folder (see checkpoint.py): a
+run restarted after a crash skips the finished dossiers and reuses the
+documents already filled, and retry_failed reruns only the failed templates.
+Outputs are only reused when the client's row, its indicator selection, the
+templates and the logo are unchanged since they were journaled.
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import BatchJournal, client_key, discard_journal, dossier_key
+from generation import client_folders, generate_dossier
+from ingestion import iter_client_rows, DEFAULT_CHUNKSIZE
+from template_scanner import scan_templates
+from utils import DEFAULT_COMPRESSLEVEL
+
+NAME_COLUMN = "Nom de l'organisme"
+
+
+def dossier_name_for(client_row):
+    """File-system safe dossier name: organisation name and row index."""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', "_", client_row.record.get(NAME_COLUMN, "")).strip(" ._")
+    return f"{name or 'dossier'}_{client_row.index}"
+
+
+def run_batch(sheet, template_folder_path, output_folder_path, rows=None, logo_path=None,
+              parallel_dossiers=1, max_workers=None, compresslevel=DEFAULT_COMPRESSLEVEL,
+              chunksize=DEFAULT_CHUNKSIZE, use_record_store=False, resume=True,
+              retry_failed=False, verify=True, indicators=None, on_result=None):
+    """
+    Generate the dossiers of every client row of sheet (or only the row
+    indexes in rows) into output_folder_path.
+
+    resume: continue the journal of an earlier run (False starts afresh)
+    retry_failed: only regenerate the templates that failed in earlier runs
+    verify: hash the outputs journaled just before a crash before reusing them
+    indicators: indicators or folders to generate (see
+    template_scanner.select_folders), narrowed per client by its
+    "Indicateurs" column
+    on_result(client_row, result, error): called from the worker thread
+    after each dossier
+    Returns a dict with dossiers, documents, skipped, errors (row index ->
+    message) and seconds.
+    """
+    start_time = time.time()
+    os.makedirs(output_folder_path, exist_ok=True)
+    if not resume:
+        discard_journal(output_folder_path)
+    journal = BatchJournal(output_folder_path, verify=verify)
+    rows = set(rows) if rows is not None else None
+    if retry_failed:
+        failed_rows = set(journal.failed_rows())
+        rows = failed_rows & rows if rows is not None else failed_rows
+
+    summary = {"dossiers": 0, "documents": 0, "skipped": 0, "errors": {}}
+    summary_lock = threading.Lock()
+    # Bounds read-ahead: a row is only parsed once a dossier slot is free
+    slots = threading.BoundedSemaphore(parallel_dossiers)
+
+    # Template tree fingerprint per folder selection, taken once per run
+    fingerprints = {}
+
+    def dossier_inputs(client_row):
+        """(dossier name, folders, dossier key, client key) of a client row."""
+        folders = client_folders(template_folder_path, client_row.record, indicators)
+        if folders not in fingerprints:
+            fingerprints[folders] = scan_templates(template_folder_path, folders).fingerprint()
+        client = client_key(client_row.mapping, logo_path)
+        key = dossier_key(client, folders, fingerprints[folders])
+        return dossier_name_for(client_row), folders, key, client
+
+    def report(client_row, result, error):
+        with summary_lock:
+            if error is None:
+                summary["dossiers"] += 1
+                summary["documents"] += result["total_files"]
+                if result["errors"]:
+                    summary["errors"][client_row.index] = "; ".join(result["errors"])
+            else:
+                summary["errors"][client_row.index] = str(error)
+        if on_result is not None:
+            on_result(client_row, result, error)
+
+    def generate(client_row, dossier_name, folders, key, client):
+        try:
+            result = error = None
+            try:
+                result = generate_dossier(
+                    template_folder_path, client_row.mapping,
+                    os.path.join(output_folder_path, dossier_name),
+                    logo_path=logo_path, max_workers=max_workers, compresslevel=compresslevel,
+                    checkpoint=journal.checkpoint(client_row.index, dossier_name, key, client),
+                    folders=folders,
+                )
+            except Exception as e:
+                error = e
+            report(client_row, result, error)
+        finally:
+            slots.release()
+
+    if use_record_store:
+        from record_store import load_client_records
+
+        records = load_client_records(sheet)
+        client_rows = records.client_rows(sorted(row for row in rows if row in records)
+                                          if rows is not None else None)
+    else:
+        client_rows = iter_client_rows(sheet, chunksize=chunksize)
+
+    with journal, ThreadPoolExecutor(max_workers=parallel_dossiers,
+                                     thread_name_prefix="batch") as executor:
+        for client_row in client_rows:
+            if rows is not None and client_row.index not in rows:
+                continue
+            try:
+                dossier_name, folders, key, client = dossier_inputs(client_row)
+            except ValueError as e:
+                # Unknown indicator, or no indicator left for this client
+                report(client_row, None, e)
+                continue
+            zip_path = os.path.join(output_folder_path, dossier_name + ".zip")
+            if not retry_failed and journal.finished(client_row.index, zip_path, key):
+                summary["skipped"] += 1
+                continue
+            slots.acquire()
+            executor.submit(generate, client_row, dossier_name, folders, key, client)
+
+    summary["seconds"] = time.time() - start_time
+    return summary
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate the dossiers of every client of a sheet")
+    parser.add_argument("sheet", help="Client spreadsheet (csv, xlsx or xls)")
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--output", default="docs")
+    parser.add_argument("--rows", type=int, nargs="*", default=None,
+                        help="Row indexes to generate (default: every client)")
+    parser.add_argument("--logo", default=None)
+    parser.add_argument("--parallel-dossiers", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Threads per stage for each dossier")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--indicators", default=None,
+                        help='Indicators or folders to generate, e.g. "1,5,Indicateur_7" (default: all)')
+    parser.add_argument("--record-cache", action="store_true",
+                        help="Read rows from the cached column store of the sheet (<sheet>.records.npz)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Ignore the journal of earlier runs and regenerate everything")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Only regenerate the templates that failed in earlier runs")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="Trust the journal without re-hashing the outputs written just before a crash")
+    args = parser.parse_args()
+
+    def on_result(client_row, result, error):
+        if error is not None:
+            print(f"row {client_row.index}: {error}")
+        else:
+            print(f"row {client_row.index}: {result['total_files']} documents "
+                  f"in {result['seconds']:.2f} s -> {result['zip_path']}")
+
+    summary = run_batch(args.sheet, args.templates, args.output, rows=args.rows,
+                        logo_path=args.logo, parallel_dossiers=args.parallel_dossiers,
+                        max_workers=args.workers, chunksize=args.chunksize,
+                        use_record_store=args.record_cache, resume=not args.fresh,
+                        retry_failed=args.retry_failed, verify=not args.no_verify,
+                        indicators=args.indicators, on_result=on_result)
+    print(f"{summary['dossiers']} dossiers, {summary['documents']} documents "
+          f"in {summary['seconds']:.2f} s, {summary['skipped']} already done, "
+          f"{len(summary['errors'])} rows with errors")
+
+
+if __name__ == "__main__":
+    main()
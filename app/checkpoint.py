@@ -0,0 +1,255 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : checkpoint.py
+# @Notice  : Completion journal making batch runs resumable
+
+"""
+Append-only journal of a batch run, so a run that died can resume where it
+stopped.
+
+Each filled document is kept under <output>/.checkpoints/<dossier>/ until its
+dossier ZIP is complete, and a (row, template, sha256) entry is appended to
+the journal. Entries carry a key hashing what their output is built from,
+so outputs are only reused when built from the same inputs:
+- a document: the client's mapping, the logo and that template's own size
+  and mtime (see document_key), so fixing one template only regenerates
+  its documents;
+- a dossier: the client's mapping, the logo, the selected folders and the
+  template tree fingerprint (see dossier_key), so a dossier whose file set
+  changed is assembled again.
+A document whose entry was lost in a crash is simply regenerated.
+
+Entries are fsynced in groups (every GROUP_SIZE entries or GROUP_SECONDS)
+rather than one by one, each group closed by a {"synced": true} line. Outputs
+are checked by size and mtime, and only those of the last group, which a
+crash may have left partly written, are hashed again: recovery time follows
+the work left, not the work done.
+
+Journal entries (JSON lines):
+    {"row": 3, "template": "Indicateur_1/x.docx", "status": "done", "key": ..., "sha256": ..., "size": ..., "mtime_ns": ...}
+    {"row": 3, "template": "Indicateur_1/y.xlsx", "status": "failed", "error": ...}
+    {"row": 3, "template": null, "status": "done", "key": ..., "zip": "ACME_3.zip", "sha256": ..., "size": ..., "mtime_ns": ..., "failed": [...]}
+The last entry of a (row, template) pair wins. A dossier entry (template
+null) marks the row finished; its failed templates can be retried alone.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+JOURNAL_NAME = "batch_journal.jsonl"
+CHECKPOINTS_FOLDER = ".checkpoints"
+GROUP_SIZE = 32
+GROUP_SECONDS = 1.0
+
+
+def sha256_of_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash(data):
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def client_key(mapping_dict, logo_path=None):
+    """Hash of the client's inputs shared by all of its documents."""
+    logo = None
+    if logo_path:
+        try:
+            stat = os.stat(logo_path)
+            logo = [os.path.abspath(logo_path), stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            logo = [logo_path]
+    return _hash([mapping_dict, logo])
+
+
+def document_key(client, template_file):
+    """Hash of what one document is built from: client key and template state."""
+    return _hash([client, template_file.size, template_file.mtime_ns])
+
+
+def dossier_key(client, folders, template_fingerprint):
+    """Hash of what a whole dossier is built from."""
+    return _hash([client, list(folders) if folders is not None else None, template_fingerprint])
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def discard_journal(output_folder_path):
+    """Set the journal of earlier runs aside and drop their kept documents."""
+    path = os.path.join(output_folder_path, JOURNAL_NAME)
+    if os.path.exists(path):
+        os.replace(path, f"{path}.{time.strftime('%Y%m%d_%H%M%S')}")
+    shutil.rmtree(os.path.join(output_folder_path, CHECKPOINTS_FOLDER), ignore_errors=True)
+
+
+class BatchJournal:
+    """
+    Completion journal of the batch run writing into output_folder_path
+    verify: hash the outputs of the last journal group before trusting them
+    """
+
+    def __init__(self, output_folder_path, path=None, verify=True,
+                 group_size=GROUP_SIZE, group_seconds=GROUP_SECONDS):
+        self.output_folder_path = output_folder_path
+        self.path = path or os.path.join(output_folder_path, JOURNAL_NAME)
+        self.verify = verify
+        self.group_size = group_size
+        self.group_seconds = group_seconds
+        self.entries = {}  # (row, template) -> last entry
+        # Entries after the last sync mark: their outputs may be partly written
+        self.unsettled = set()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by the crash
+                        continue
+                    if entry.get("synced"):
+                        self.unsettled.clear()
+                        continue
+                    self.entries[(entry["row"], entry["template"])] = entry
+                    self.unsettled.add((entry["row"], entry["template"]))
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, entry):
+        with self._lock:
+            self.entries[(entry["row"], entry["template"])] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._unsynced += 1
+            if (self._unsynced >= self.group_size
+                    or time.monotonic() - self._last_sync >= self.group_seconds):
+                self._sync()
+
+    def _sync(self):
+        self._file.write(json.dumps({"synced": True}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                if self._unsynced:
+                    self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def dossier_entry(self, row):
+        return self.entries.get((row, None))
+
+    def intact(self, entry_key, path):
+        """Whether the output of a journal entry is still the one journaled."""
+        entry = self.entries[entry_key]
+        try:
+            if _file_state(path) != {"size": entry.get("size"), "mtime_ns": entry.get("mtime_ns")}:
+                return False
+            if self.verify and entry_key in self.unsettled:
+                return sha256_of_file(path) == entry["sha256"]
+        except OSError:
+            return False
+        return True
+
+    def finished(self, row, zip_path, key):
+        """Whether the dossier of row was completed from the inputs hashed in key."""
+        entry = self.dossier_entry(row)
+        if entry is None or entry["status"] != "done" or entry.get("key") != key:
+            return False
+        return self.intact((row, None), zip_path)
+
+    def failed_rows(self):
+        """Rows whose dossier was finished with failed templates."""
+        return sorted(row for (row, template), entry in self.entries.items()
+                      if template is None and entry.get("failed"))
+
+    def checkpoint(self, row, dossier_name, key, client):
+        return DossierCheckpoint(self, row, dossier_name, key, client)
+
+
+class DossierCheckpoint:
+    """
+    Finished documents of one dossier, handed to generation.generate_dossier
+    key: dossier_key of the dossier; client: client_key of its row
+    """
+
+    def __init__(self, journal, row, dossier_name, key, client):
+        self.journal = journal
+        self.row = row
+        self.dossier_name = dossier_name
+        self.key = key
+        self.client = client
+        self.folder = os.path.join(journal.output_folder_path, CHECKPOINTS_FOLDER, dossier_name)
+
+    def _path(self, rel_path):
+        return os.path.join(self.folder, rel_path)
+
+    def completed(self, template_file):
+        """Path of the intact finished document of a template_scanner.TemplateFile, or None."""
+        rel_path = template_file.rel_path
+        entry = self.journal.entries.get((self.row, rel_path))
+        if (entry is None or entry["status"] != "done"
+                or entry.get("key") != document_key(self.client, template_file)):
+            return None
+        path = self._path(rel_path)
+        return path if self.journal.intact((self.row, rel_path), path) else None
+
+    def save(self, template_file, data):
+        """Keep a finished document and journal it."""
+        rel_path = template_file.rel_path
+        path = self._path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.journal.append({
+            "row": self.row, "template": rel_path, "status": "done",
+            "key": document_key(self.client, template_file),
+            "sha256": hashlib.sha256(data).hexdigest(), **_file_state(path),
+        })
+
+    def failed(self, rel_path, error):
+        self.journal.append({"row": self.row, "template": rel_path, "status": "failed",
+                             "error": str(error)})
+
+    def finish(self, zip_path, failed_templates):
+        """Journal the complete dossier; its documents are dropped unless some failed."""
+        self.journal.append({
+            "row": self.row, "template": None, "status": "done", "key": self.key,
+            "zip": os.path.basename(zip_path), "sha256": sha256_of_file(zip_path),
+            **_file_state(zip_path), "failed": sorted(failed_templates),
+        })
+        self.journal.sync()
+        if not failed_templates:
+            shutil.rmtree(self.folder, ignore_errors=True)
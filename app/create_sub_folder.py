@@ -1,33 +1,51 @@
 # We want to look for all folder that contains the patttern "Indicateur" in the name
 # and create a subfolder in this folder called "Preuves_Mise_en_Oeuvre"+parent_folder_name
 
+import argparse
 import os
-import shutil
 
+from template_scanner import scan_templates
 
-def create_sub_folder(parent_folder_path):
-    for root, dirs, files in os.walk(parent_folder_path):
-        for dir in dirs:
-            if "Indicateur_" in dir and "Preuves_Mise_en_Oeuvre" not in dir:
-                parent_name = "_".join(dir.split("_")[:2])
-                sub_folder_name = "Preuves_Mise_en_Oeuvre" + "_" + parent_name
-                new_folder_path = os.path.join(root, dir, sub_folder_name)
+
+def create_sub_folder(parent_folder_path, dry_run=False):
+    created = []
+    for directory in scan_templates(parent_folder_path).directories:
+        dir = os.path.basename(directory)
+        if "Indicateur_" in dir and "Preuves_Mise_en_Oeuvre" not in dir:
+            parent_name = "_".join(dir.split("_")[:2])
+            sub_folder_name = "Preuves_Mise_en_Oeuvre" + "_" + parent_name
+            new_folder_path = os.path.join(parent_folder_path, directory, sub_folder_name)
+            if dry_run:
+                print(f"Would create folder: {new_folder_path}")
+            else:
                 os.makedirs(new_folder_path, exist_ok=True)
                 print(f"Created folder: {new_folder_path}")
+            created.append(new_folder_path)
+    return created
 
 
-create_sub_folder("app/templates")
-
 # Now we want to add a file "Consigne.txt" to each of the newly created subfolders
 
 
-def add_consigne_txt(parent_folder_path):
-    for root, dirs, files in os.walk(parent_folder_path):
-        for dir in dirs:
-            if "Preuves_Mise_en_Oeuvre_Indicateur" in dir:
-                consigne_file_path = os.path.join(root, dir, "Consigne.txt")
+def add_consigne_txt(parent_folder_path, dry_run=False):
+    written = []
+    for directory in scan_templates(parent_folder_path).directories:
+        if "Preuves_Mise_en_Oeuvre_Indicateur" in os.path.basename(directory):
+            consigne_file_path = os.path.join(parent_folder_path, directory, "Consigne.txt")
+            if dry_run:
+                print(f"Would write: {consigne_file_path}")
+            else:
                 with open(consigne_file_path, "w") as f:
                     f.write("Veuillez ajouter ici les preuves de mise en oeuvre")
+            written.append(consigne_file_path)
+    return written
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the Preuves_Mise_en_Oeuvre subfolders")
+    parser.add_argument("templates", nargs="?", default="app/templates")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
 
-add_consigne_txt("app/templates")
+    create_sub_folder(args.templates, args.dry_run)
+    add_consigne_txt(args.templates, args.dry_run)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : generation.py
+# @Notice  : Dossier generation shared by the Streamlit app and the HTTP service
+
+import gc
+import io
+import os
+import shutil
+import threading
+import time
+import zipfile
+from typing import NamedTuple, Optional
+
+from tqdm import tqdm
+
+from Replacer import WordReplace, CompiledWordReplace
+from pipeline import Stage, run_pipeline
+from template_compiler import lookup_compiled_template
+from template_scanner import TemplateFile, scan_templates, select_folders
+from static_archive import ensure_static_archive, static_entry_filter
+from scheduling import get_timing_history, longest_first, default_worker_count
+from utils import (
+    DEFAULT_COMPRESSLEVEL, set_date_and_place, replace_first_image_in_header,
+    prepare_bytes_entry, write_bytes_entry, write_raw_entry, copy_raw_entries, archive_stats
+)
+
+# Optional client sheet column listing the indicators of the client's audit
+INDICATORS_COLUMN = "Indicateurs"
+
+# Template bytes kept in memory by long-lived processes (see preload_templates)
+_template_bytes = {}
+_template_bytes_lock = threading.Lock()
+
+
+def preload_templates(template_folder_path):
+    """
+    Read every Word (compiled when available) and Excel template into memory
+    so that generation no longer touches the template files on disk.
+    Returns the number of bytes loaded.
+    """
+    inventory = scan_templates(template_folder_path)
+    loaded = {}
+    for template_file in inventory.word_files() + inventory.excel_files():
+        path = template_file.path
+        if template_file.kind == "word":
+            compiled = lookup_compiled_template(path, template_folder_path)
+            if compiled is not None:
+                path = compiled[0]
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            loaded[path] = (stat.st_size, stat.st_mtime_ns, f.read())
+    with _template_bytes_lock:
+        _template_bytes.clear()
+        _template_bytes.update(loaded)
+    return sum(len(entry[2]) for entry in loaded.values())
+
+
+def open_template(path):
+    """Return an in-memory copy of a preloaded template, or its path."""
+    entry = _template_bytes.get(path)
+    if entry is not None:
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) == entry[:2]:
+            return io.BytesIO(entry[2])
+    return path
+
+
+class DocumentJob(NamedTuple):
+    """One template to fill for one client"""
+
+    kind: str  # "word" or "excel"
+    file_path: str
+    mapping_dict: dict
+    template_folder_path: str
+    logo_path: Optional[str] = None
+    template_file: Optional[TemplateFile] = None
+    compresslevel: int = DEFAULT_COMPRESSLEVEL
+
+    @property
+    def rel_path(self):
+        return os.path.relpath(self.file_path, self.template_folder_path)
+
+
+def load_document(job, _=None):
+    """Pipeline stage: open and parse the template of a job."""
+    if job.kind == "word":
+        compiled = lookup_compiled_template(job.file_path, job.template_folder_path)
+        if compiled is not None:
+            compiled_path, locations = compiled
+            return CompiledWordReplace(open_template(compiled_path), locations)
+        return WordReplace(open_template(job.file_path))
+
+    # openpyxl is only imported once an Excel template is actually processed
+    from ExcelReplacer import ExcelReplace
+
+    return ExcelReplace(open_template(job.file_path))
+
+
+def fill_document(job, document):
+    """Pipeline stage: replace the placeholders of a loaded template."""
+    if job.kind == "word":
+        document.replace_doc(job.mapping_dict)
+        set_date_and_place(document.docx)
+        if job.logo_path and os.path.exists(job.logo_path):
+            replace_first_image_in_header(document.docx, job.logo_path)
+    else:
+        document.replace_excel(job.mapping_dict)
+        document.set_date_and_place()
+    return document
+
+
+class SavedDocument(NamedTuple):
+    """A filled document, with its zip entry already compressed"""
+
+    data: bytes
+    zinfo: zipfile.ZipInfo
+    raw: bytes
+
+
+def serialise_document(job, document):
+    """Pipeline stage: save a filled document to bytes and compress its zip
+    entry, so compression runs on the stage workers rather than in the sink."""
+    buffer = io.BytesIO()
+    document.save(buffer)
+    data = buffer.getvalue()
+    return SavedDocument(data, *prepare_bytes_entry(job.rel_path, data, job.compresslevel))
+
+
+def process_word_document(args):
+    """
+    Process a single Word document - designed for parallel execution
+    """
+    file_path, mapping_dict, logo_path, template_folder_path, output_folder_path = args
+    job = DocumentJob("word", file_path, mapping_dict, template_folder_path, logo_path)
+
+    try:
+        document = fill_document(job, load_document(job))
+        path_to_save = os.path.join(output_folder_path, job.rel_path)
+        os.makedirs(os.path.dirname(path_to_save), exist_ok=True)
+        document.save(path_to_save)
+        return True, file_path
+    except Exception as e:
+        return False, f"Error processing {os.path.basename(file_path)}: {str(e)}"
+
+
+def process_excel_document(args):
+    """
+    Process a single Excel document - designed for parallel execution
+    """
+    file_path, mapping_dict, template_folder_path, output_folder_path = args
+    job = DocumentJob("excel", file_path, mapping_dict, template_folder_path)
+    path_to_save = os.path.join(output_folder_path, job.rel_path)
+    os.makedirs(os.path.dirname(path_to_save), exist_ok=True)
+
+    try:
+        fill_document(job, load_document(job)).save(path_to_save)
+        return True, file_path
+    except Exception as e:
+        # Ship the original template, as the former full tree copy did
+        shutil.copy2(file_path, path_to_save)
+        return False, f"Error processing {os.path.basename(file_path)}: {str(e)}"
+
+
+def client_folders(template_folder_path, record=None, indicators=None):
+    """
+    Top-level template folders to generate for a client (None: all): the
+    run selection, narrowed by the client's "Indicateurs" column if filled.
+    Raises ValueError for an unknown indicator, or when the two selections
+    have no folder in common.
+    """
+    run_folders = select_folders(template_folder_path, indicators)
+    own_folders = select_folders(template_folder_path, (record or {}).get(INDICATORS_COLUMN))
+    if run_folders is None or own_folders is None:
+        return own_folders if run_folders is None else run_folders
+    folders = tuple(folder for folder in run_folders if folder in own_folders)
+    if not folders:
+        raise ValueError(f"none of the selected indicators ({', '.join(run_folders)}) is among "
+                         f"the client's {INDICATORS_COLUMN} ({', '.join(own_folders)})")
+    return folders
+
+
+def generate_dossier(template_folder_path, mapping_dict, output_folder_path,
+                     logo_path=None, use_parallel=True, max_workers=None,
+                     compresslevel=DEFAULT_COMPRESSLEVEL, progress_callback=None,
+                     profiler=None, checkpoint=None, folders=None, record_timings=True):
+    """
+    Fill every Word and Excel template for one client into <output>.zip.
+
+    Word and Excel templates share one work queue, ordered by decreasing
+    estimated cost, and flow through overlapping load, fill and save stages
+    (see pipeline.py); the calling thread writes each finished document
+    straight into the archive, then appends the prebuilt static entries.
+
+    max_workers: threads per stage, defaults from available cores and past timings
+    progress_callback(done, total, kind, success, result): called from the
+    calling thread after each document
+    profiler: optional started profiling.RunProfiler covering every stage
+    checkpoint: optional checkpoint.DossierCheckpoint; documents it already
+    holds are reused, new ones are saved to it and the dossier is journaled
+    folders: only generate these top-level folders (see client_folders);
+    the other subtrees are neither scanned nor filled nor zipped
+    record_timings: record the run's timings into the persisted history
+    (False for warm-up runs, whose cold-cache timings would skew it)
+    Returns a dict with zip_path, total_files, reused_files, errors, zip_stats,
+    stage_seconds, workers and seconds.
+    """
+    start_time = time.time()
+    if folders is not None and not folders:
+        raise ValueError("no template folder selected")
+
+    inventory = scan_templates(template_folder_path, folders)
+    static_archive_path = ensure_static_archive(inventory)
+
+    # Most expensive templates first, so no large job is left running alone
+    history = get_timing_history(template_folder_path)
+    template_files = longest_first(inventory.word_files() + inventory.excel_files(), history)
+    if max_workers is None:
+        max_workers = default_worker_count(template_files, history)
+    if not use_parallel:
+        max_workers = 1
+
+    # Documents finished by an earlier, interrupted run
+    reused = {}
+    if checkpoint is not None:
+        for f in template_files:
+            path = checkpoint.completed(f)
+            if path is not None:
+                reused[f.rel_path] = path
+
+    jobs = [
+        DocumentJob(f.kind, f.path, mapping_dict, template_folder_path,
+                    logo_path if f.kind == "word" else None, f, compresslevel)
+        for f in template_files if f.rel_path not in reused
+    ]
+    wrap = profiler.wrap if profiler is not None else (lambda fn: fn)
+    stages = [
+        Stage("load", wrap(load_document), max_workers),
+        Stage("fill", wrap(fill_document), max_workers),
+        Stage("save", wrap(serialise_document), max(1, max_workers // 2)),
+    ]
+    total_files = len(jobs)
+    errors = []
+    failed_templates = []
+    file_counter = 0
+    busy_seconds = 0.0
+    archive_seconds = 0.0
+    progress = tqdm(total=total_files)
+
+    zip_path = output_folder_path + ".zip"
+    os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, strict_timestamps=False) as zipf:
+        for rel_path, path in reused.items():
+            with open(path, "rb") as f:
+                write_bytes_entry(zipf, rel_path, f.read(), compresslevel)
+
+        def archive(item):
+            """Sink stage: write one finished document into the dossier."""
+            nonlocal file_counter, busy_seconds, archive_seconds
+            job = item.job
+            success = item.error is None
+            result = job.file_path
+            if success:
+                if record_timings:
+                    history.record(job.template_file, item.seconds)
+                if checkpoint is not None:
+                    checkpoint.save(job.template_file, item.value.data)
+                write_start = time.perf_counter()
+                write_raw_entry(zipf, item.value.zinfo, item.value.raw)
+                archive_seconds += time.perf_counter() - write_start
+            else:
+                result = f"Error processing {os.path.basename(job.file_path)}: {str(item.error)}"
+                errors.append(result)
+                failed_templates.append(job.rel_path)
+                if checkpoint is not None:
+                    checkpoint.failed(job.rel_path, item.error)
+                if job.kind == "excel":
+                    # Ship the original template, as the former full tree copy did
+                    with open(job.file_path, "rb") as f:
+                        write_bytes_entry(zipf, job.rel_path, f.read(), compresslevel)
+
+            file_counter += 1
+            busy_seconds += item.seconds
+            progress.update()
+            if progress_callback is not None:
+                progress_callback(file_counter, total_files, job.kind.capitalize(), success, result)
+            # Free the documents of finished jobs
+            item.value = None
+            if file_counter % max_workers == 0:
+                gc.collect()
+
+        pipeline_start = time.perf_counter()
+        stage_seconds = run_pipeline(jobs, stages, wrap(archive))
+        pipeline_seconds = time.perf_counter() - pipeline_start
+        progress.close()
+
+        archive_start = time.time()
+        wrap(copy_raw_entries)(static_archive_path, zipf, include=static_entry_filter(folders))
+        zip_stats = archive_stats(zipf, archive_start)
+        zip_stats["seconds"] += archive_seconds
+
+    if record_timings:
+        if pipeline_seconds and max_workers > 1:
+            history.record_run(max_workers, busy_seconds, pipeline_seconds)
+        history.save()
+    if checkpoint is not None:
+        checkpoint.finish(zip_path, failed_templates)
+
+    return {
+        "zip_path": zip_path,
+        "total_files": total_files + len(reused),
+        "reused_files": len(reused),
+        "errors": errors,
+        "zip_stats": zip_stats,
+        "stage_seconds": stage_seconds,
+        "workers": max_workers,
+        "seconds": time.time() - start_time,
+    }
+
+
+def main():
+    """Generate one dossier from the command line."""
+    import argparse
+
+    from record_store import load_client_records
+
+    parser = argparse.ArgumentParser(description="Generate a dossier for one client row")
+    parser.add_argument("sheet", help="Client spreadsheet (xlsx or csv)")
+    parser.add_argument("--row", type=int, default=1)
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--output", default=None,
+                        help="Output path without .zip (default: docs/<organisme>)")
+    parser.add_argument("--logo", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--indicators", default=None,
+                        help='Indicators or folders to generate, e.g. "1,5,Indicateur_7" (default: all)')
+    parser.add_argument("--profile", metavar="ARTIFACT", default=None,
+                        help="Profile the run and write the artifact zip here")
+    args = parser.parse_args()
+
+    records = load_client_records(args.sheet)
+    mapping_dict = records.mapping(args.row)
+    try:
+        folders = client_folders(args.templates, records.record(args.row), args.indicators)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or os.path.join("docs", records.record(args.row)["Nom de l'organisme"])
+
+    profiler = None
+    if args.profile:
+        from profiling import RunProfiler
+
+        profiler = RunProfiler().start()
+    try:
+        result = generate_dossier(args.templates, mapping_dict, output, logo_path=args.logo,
+                                  max_workers=args.workers, profiler=profiler, folders=folders)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+    for error in result["errors"]:
+        print(error)
+    print(f"{result['total_files']} documents in {result['seconds']:.2f} s -> {result['zip_path']}")
+    if profiler is not None:
+        profiler.write_artifact(args.profile)
+        print(profiler.summary(10))
+        print(f"Profile written to {args.profile}")
+
+
+if __name__ == "__main__":
+    main()
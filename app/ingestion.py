@@ -0,0 +1,152 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : ingestion.py
+# @Notice  : Streaming reader of client spreadsheets
+
+"""
+Stream client rows out of large CSV/XLSX exports.
+
+The client sheet layout is the one the app expects: a header row of column
+names, then a first row giving the placeholder of each column (see
+placeholder_columns), then one row per client. Rows are read in chunks
+(CSV) or iterated in openpyxl read-only mode (XLSX) and yielded one at a time
+as normalised mappings, so memory stays flat and each client can be
+generated as soon as its row is parsed. Rows left entirely blank (such as the
+formatted but empty rows openpyxl reports at the end of a sheet) are skipped,
+and columns are named the way pandas names them, so the rows match
+pandas.read_excel / read_csv and record_store.py.
+"""
+
+import datetime
+import math
+import os
+from typing import Dict, Iterator, NamedTuple
+
+DEFAULT_CHUNKSIZE = 500
+DATE_FORMAT = "%d/%m/%Y"
+
+
+class ClientRow(NamedTuple):
+    """One client of the sheet"""
+
+    index: int  # row index as in the DataFrame (0 is the placeholder row)
+    record: Dict[str, str]  # column -> normalised value
+    mapping: Dict[str, str]  # placeholder -> normalised value
+
+
+def normalise_value(value):
+    """Cell value as written into documents: blanks empty, integral floats without .0, dates dd/mm/YYYY."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value.is_integer():
+            return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, datetime.date):
+        return value.strftime(DATE_FORMAT)
+    text = str(value).strip()
+    return "" if text.lower() in ("nan", "nat", "none") else text
+
+
+def placeholder_columns(columns, placeholder_row):
+    """{placeholder: column} for the columns whose placeholder cell is filled."""
+    mappings = {}
+    for column, placeholder in zip(columns, placeholder_row):
+        placeholder = normalise_value(placeholder)
+        if placeholder:
+            mappings[placeholder] = column
+    return mappings
+
+
+def column_names(header):
+    """Column names of a header row as pandas gives them: blanks become
+    "Unnamed: <position>" and repeated names get a ".1", ".2"... suffix."""
+    columns = []
+    seen = {}
+    for position, name in enumerate(header):
+        name = normalise_value(name) or f"Unnamed: {position}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _rows_from_values(columns, rows, first_index=0):
+    """Turn (placeholder row, client rows...) value tuples into ClientRows."""
+    mappings = None
+    positions = None
+    for index, values in enumerate(rows, start=first_index):
+        if mappings is None:
+            mappings = placeholder_columns(columns, values)
+            positions = {placeholder: columns.index(column) for placeholder, column in mappings.items()}
+            continue
+        normalised = [normalise_value(value) for value in values]
+        if not any(normalised):
+            continue
+        normalised += [""] * (len(columns) - len(normalised))
+        record = dict(zip(columns, normalised))
+        yield ClientRow(index, record, {
+            placeholder: normalised[position] for placeholder, position in positions.items()
+        })
+
+
+def _iter_csv(source, chunksize):
+    import pandas as pd
+
+    with pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False) as reader:
+        first_chunk = next(reader, None)
+        if first_chunk is None:
+            return
+
+        def rows():
+            yield from first_chunk.itertuples(index=False, name=None)
+            for chunk in reader:
+                yield from chunk.itertuples(index=False, name=None)
+
+        yield from _rows_from_values(list(first_chunk.columns), rows())
+
+
+def _iter_xlsx(source):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = column_names(header)
+        yield from _rows_from_values(columns, rows)
+    finally:
+        workbook.close()
+
+
+def _iter_dataframe(source):
+    # Legacy .xls files cannot be streamed by openpyxl
+    import pandas as pd
+
+    df = pd.read_excel(source)
+    yield from _rows_from_values(list(df.columns), df.itertuples(index=False, name=None))
+
+
+def iter_client_rows(source, file_format=None, chunksize=DEFAULT_CHUNKSIZE) -> Iterator[ClientRow]:
+    """
+    Yield the clients of a sheet one at a time.
+    source: path or file object; file_format: "csv", "xlsx" or "xls"
+    (default: from the file name)
+    """
+    if file_format is None:
+        name = source if isinstance(source, str) else getattr(source, "name", "")
+        file_format = os.path.splitext(name)[1].lstrip(".").lower() or "xlsx"
+    if file_format == "csv":
+        return _iter_csv(source, chunksize)
+    if file_format == "xls":
+        return _iter_dataframe(source)
+    return _iter_xlsx(source)
@@ -0,0 +1,411 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : load_test.py
+# @Notice  : Local load test of dossier generation
+
+"""
+Load test simulating concurrent users generating dossiers.
+
+Each phase runs a number of concurrent sessions; every session generates
+dossiers in a loop, picking a client row and a template set (indicator
+selection) from the configured mixes. Requests go either straight to the
+library (generate_dossier, as the Streamlit app does) or to a running local
+service.py instance (stand-in for the web front end).
+
+While a phase runs, a sampler records CPU usage and resident memory of the
+generating process (this one, or the service given by --service-pid). The
+JSON report holds per phase: latency percentiles, throughput, errors, CPU,
+peak RSS and the samples over time. Reports of two versions or worker
+configurations are compared with the compare command.
+
+Usage:
+    python load_test.py run clients.xlsx --templates templates --sessions 1 2 4 \\
+        --duration 30 --template-sets all 1,2 --report report.json
+    python load_test.py run clients.xlsx --url http://127.0.0.1:8765 --service-pid 1234
+    python load_test.py compare before.json after.json
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from service import percentiles
+
+REPORT_VERSION = 1
+DEFAULT_SAMPLE_INTERVAL = 0.5
+MAX_ERROR_MESSAGES = 5  # distinct error messages kept per phase
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def process_cpu_seconds(pid=None):
+    """User + system CPU seconds of a process (this one by default)."""
+    if pid is None:
+        return time.process_time()
+    with open(f"/proc/{pid}/stat") as f:
+        # Fields after the command name, which may contain spaces
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+
+def process_rss_bytes(pid=None):
+    """Current resident set size of a process, or None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class ResourceSampler:
+    """Samples CPU % and RSS of a process at a fixed interval"""
+
+    def __init__(self, pid=None, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # [seconds since start, cpu percent, rss MB]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def _run(self):
+        start_time = last_time = time.perf_counter()
+        last_cpu = process_cpu_seconds(self.pid)
+        stopped = False
+        while not stopped:
+            # A last sample when stopped, so even a phase shorter than the
+            # interval gets its CPU and RSS
+            stopped = self._stop.wait(self.interval)
+            now = time.perf_counter()
+            if now <= last_time:
+                continue
+            cpu = process_cpu_seconds(self.pid)
+            rss = process_rss_bytes(self.pid)
+            self.samples.append([
+                round(now - start_time, 3),
+                round(100 * (cpu - last_cpu) / (now - last_time), 1),
+                round(rss / 1024 / 1024, 1) if rss is not None else None,
+            ])
+            last_time, last_cpu = now, cpu
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        cpu = [sample[1] for sample in self.samples]
+        rss = [sample[2] for sample in self.samples if sample[2] is not None]
+        return {
+            "cpu_percent_mean": round(sum(cpu) / len(cpu), 1) if cpu else None,
+            "cpu_percent_max": max(cpu) if cpu else None,
+            "peak_rss_mb": max(rss) if rss else None,
+        }
+
+
+class LibraryTarget:
+    """Generates dossiers in this process, like the Streamlit app"""
+
+    def __init__(self, template_folder_path, max_workers=None, logo_path=None):
+        from generation import preload_templates
+        from workspace import default_workspace_root
+
+        self.template_folder_path = template_folder_path
+        self.max_workers = max_workers
+        self.logo_path = logo_path
+        workspace_root = default_workspace_root("load_test")
+        os.makedirs(workspace_root, exist_ok=True)
+        self.workspace = tempfile.mkdtemp(prefix="load_test_", dir=workspace_root)
+        preload_templates(template_folder_path)
+
+    def generate(self, client_row, folders):
+        """Returns the number of documents of the dossier."""
+        from generation import generate_dossier
+
+        output_folder_path = tempfile.mkdtemp(dir=self.workspace)
+        try:
+            result = generate_dossier(
+                self.template_folder_path, client_row.mapping,
+                os.path.join(output_folder_path, "dossier"),
+                logo_path=self.logo_path, max_workers=self.max_workers, folders=folders,
+            )
+        finally:
+            shutil.rmtree(output_folder_path, ignore_errors=True)
+        if result["errors"]:
+            raise RuntimeError("; ".join(result["errors"]))
+        return result["total_files"]
+
+    def close(self):
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+
+class ServiceTarget:
+    """Sends dossier requests to a running service.py"""
+
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def generate(self, client_row, folders):
+        body = json.dumps({
+            "mapping": client_row.mapping,
+            "name": f"dossier_{client_row.index}",
+            "indicators": list(folders) if folders is not None else None,
+        }).encode("utf-8")
+        request = urllib.request.Request(self.url + "/generate", data=body,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return int(response.headers.get("X-Documents", 0))
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                raise OverflowError("rejected by the service (503)") from None
+            raise
+
+    def close(self):
+        pass
+
+
+def run_phase(target, client_rows, template_sets, sessions, duration=None,
+              requests_per_session=None, sampler_pid=None, seed=0):
+    """
+    Run `sessions` concurrent sessions until duration seconds have passed or
+    each session made requests_per_session requests. Returns the phase report.
+    """
+    records = []  # (start offset, latency, outcome, documents)
+    error_messages = {}  # repr of the exception -> count, first MAX_ERROR_MESSAGES kept
+    records_lock = threading.Lock()
+    phase_start = time.perf_counter()
+    deadline = phase_start + duration if duration else None
+
+    def session(number):
+        mix = random.Random(seed * 1000 + number)
+        made = 0
+        while True:
+            if requests_per_session is not None and made >= requests_per_session:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            client_row = mix.choice(client_rows)
+            folders = mix.choice(template_sets)
+            start_time = time.perf_counter()
+            documents = 0
+            message = None
+            try:
+                documents = target.generate(client_row, folders)
+                outcome = "ok"
+            except OverflowError:
+                outcome = "rejected"
+            except Exception as e:
+                outcome = "error"
+                message = repr(e)
+            latency = time.perf_counter() - start_time
+            with records_lock:
+                records.append((start_time - phase_start, latency, outcome, documents))
+                if message in error_messages:
+                    error_messages[message] += 1
+                elif message is not None and len(error_messages) < MAX_ERROR_MESSAGES:
+                    error_messages[message] = 1
+            made += 1
+
+    sampler = ResourceSampler(sampler_pid).start()
+    threads = [threading.Thread(target=session, args=(n,), name=f"load-session-{n}")
+               for n in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - phase_start
+    sampler.stop()
+
+    latencies = [latency for _, latency, outcome, _ in records if outcome == "ok"]
+    documents = sum(record[3] for record in records)
+    phase = {
+        "sessions": sessions,
+        "seconds": round(seconds, 3),
+        "requests": len(records),
+        "ok": len(latencies),
+        "errors": sum(1 for record in records if record[2] == "error"),
+        "rejected": sum(1 for record in records if record[2] == "rejected"),
+        "error_messages": error_messages,
+        "dossiers_per_minute": round(60 * len(latencies) / seconds, 2) if seconds else None,
+        "documents_per_second": round(documents / seconds, 2) if seconds else None,
+        "latency_seconds": dict(
+            percentiles(latencies),
+            mean=sum(latencies) / len(latencies) if latencies else None,
+            max=max(latencies) if latencies else None,
+        ),
+    }
+    phase.update(sampler.summary())
+    phase["samples"] = sampler.samples
+    phase["requests_timeline"] = [[round(r[0], 3), round(r[1], 3), r[2]] for r in records]
+    return phase
+
+
+def run_load_test(sheet, template_folder_path="templates", sessions=(1,), duration=30,
+                  requests_per_session=None, rows=None, template_sets=("all",), url=None,
+                  service_pid=None, max_workers=None, logo_path=None, seed=0, label=None):
+    """Run one phase per session count and return the report dict."""
+    from generation import client_folders
+    from record_store import load_client_records
+
+    records = load_client_records(sheet)
+    client_rows = records.client_rows([row for row in rows if row in records] if rows else None)
+    if not client_rows:
+        raise ValueError("no client row to generate")
+    # Selections are resolved once, not per request
+    resolved_sets = [None if selection == "all" else client_folders(template_folder_path, None, selection)
+                     for selection in template_sets]
+
+    if url:
+        target = ServiceTarget(url)
+    else:
+        target = LibraryTarget(template_folder_path, max_workers, logo_path)
+        service_pid = None
+    try:
+        phases = []
+        for count in sessions:
+            phase = run_phase(target, client_rows, resolved_sets, count, duration,
+                              requests_per_session, service_pid, seed)
+            latency = phase["latency_seconds"]
+            print(f"{count} sessions: {phase['ok']}/{phase['requests']} ok, "
+                  f"{phase['dossiers_per_minute']} dossiers/min, "
+                  f"p50 {_format_seconds(latency['p50'])} p99 {_format_seconds(latency['p99'])}, "
+                  f"CPU {phase['cpu_percent_mean']}%, peak RSS {phase['peak_rss_mb']} MB")
+            for message, occurrences in phase["error_messages"].items():
+                print(f"  {occurrences} x {message}")
+            phases.append(phase)
+    finally:
+        target.close()
+
+    return {
+        "version": REPORT_VERSION,
+        "label": label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "sheet": os.path.basename(sheet),
+            "templates": template_folder_path,
+            "mode": "service" if url else "library",
+            "url": url,
+            "workers": max_workers,
+            "duration": duration,
+            "requests_per_session": requests_per_session,
+            "rows": [row.index for row in client_rows],
+            "template_sets": list(template_sets),
+            "seed": seed,
+        },
+        "host": {
+            "cores": os.cpu_count(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "phases": phases,
+    }
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def _change(before, after):
+    if before in (None, 0) or after is None:
+        return ""
+    return f"{100 * (after - before) / before:+.0f}%"
+
+
+COMPARED_METRICS = (
+    ("p50 s", lambda p: p["latency_seconds"]["p50"]),
+    ("p90 s", lambda p: p["latency_seconds"]["p90"]),
+    ("p99 s", lambda p: p["latency_seconds"]["p99"]),
+    ("dossiers/min", lambda p: p["dossiers_per_minute"]),
+    ("errors", lambda p: p["errors"] + p["rejected"]),
+    ("cpu %", lambda p: p["cpu_percent_mean"]),
+    ("peak RSS MB", lambda p: p["peak_rss_mb"]),
+)
+
+
+def compare_reports(before, after):
+    """Lines comparing the phases with the same session count of two reports."""
+    lines = [f"{'sessions':>8}  {'metric':<14}{'before':>10}{'after':>10}{'change':>9}"]
+    after_phases = {phase["sessions"]: phase for phase in after["phases"]}
+    for phase in before["phases"]:
+        other = after_phases.get(phase["sessions"])
+        if other is None:
+            continue
+        for name, metric in COMPARED_METRICS:
+            old, new = metric(phase), metric(other)
+            lines.append(f"{phase['sessions']:>8}  {name:<14}"
+                         f"{'-' if old is None else round(old, 2):>10}"
+                         f"{'-' if new is None else round(new, 2):>10}{_change(old, new):>9}")
+    return lines
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test of dossier generation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run a load test and write a JSON report")
+    run_parser.add_argument("sheet", help="Client spreadsheet providing the rows")
+    run_parser.add_argument("--templates", default="templates")
+    run_parser.add_argument("--sessions", type=int, nargs="+", default=[1],
+                            help="Concurrent sessions, one phase per value (e.g. 1 2 4 8)")
+    run_parser.add_argument("--duration", type=float, default=30,
+                            help="Seconds per phase (0: only --requests-per-session)")
+    run_parser.add_argument("--requests-per-session", type=int, default=None)
+    run_parser.add_argument("--rows", type=int, nargs="*", default=None,
+                            help="Row mix, repeat a row to weight it (default: every client)")
+    run_parser.add_argument("--template-sets", nargs="+", default=["all"],
+                            help='Template set mix: "all" or an indicator selection such as "1,5"')
+    run_parser.add_argument("--url", default=None,
+                            help="Target a running service.py instead of the library")
+    run_parser.add_argument("--service-pid", type=int, default=None,
+                            help="Process sampled for CPU and RSS in service mode")
+    run_parser.add_argument("--workers", type=int, default=None, help="Threads per stage (library mode)")
+    run_parser.add_argument("--logo", default=None)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--label", default=None, help="Name of the version or configuration")
+    run_parser.add_argument("--report", default="load_test_report.json")
+
+    compare_parser = commands.add_parser("compare", help="Compare two reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if not args.duration and not args.requests_per_session:
+            parser.error("give a --duration or --requests-per-session")
+        report = run_load_test(
+            args.sheet, args.templates, args.sessions, args.duration or None,
+            args.requests_per_session, args.rows, args.template_sets, args.url, args.service_pid,
+            args.workers, args.logo, args.seed, args.label,
+        )
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+    else:
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        print(f"{before.get('label') or args.before} -> {after.get('label') or args.after}")
+        for line in compare_reports(before, after):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : pipeline.py
+# @Notice  : Staged work queue with bounded queues between stages
+
+"""
+Generic pipeline used to overlap the load, fill, save and archive steps.
+
+Every stage has its own worker threads and reads from a bounded queue fed by
+the previous stage, so parsing one document, filling another and serialising
+a third happen at the same time, and a slow stage applies back-pressure
+instead of buffering the whole run in memory. The last stage (the sink) runs
+in the calling thread, which keeps UI callbacks on that thread.
+
+A stage function receiving an item whose previous stage failed is skipped;
+the failure travels with the item down to the sink.
+"""
+
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, List, NamedTuple, Optional
+
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    """One pipeline step: fn(job, value) -> value, run on `workers` threads"""
+
+    name: str
+    fn: Callable[[Any, Any], Any]
+    workers: int = 1
+
+
+class PipelineItem:
+    """A job travelling through the stages"""
+
+    __slots__ = ("job", "value", "error", "seconds")
+
+    def __init__(self, job):
+        self.job = job
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self.seconds = 0.0  # time spent in stage functions
+
+
+def run_pipeline(jobs, stages: List[Stage], sink: Callable[[PipelineItem], None],
+                 queue_size=None):
+    """
+    Push jobs through the stages and hand every finished item to sink, in
+    completion order. Returns the busy seconds spent in each stage.
+    """
+    if queue_size is None:
+        queue_size = 2 * max(stage.workers for stage in stages)
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    busy = Counter()
+    busy_lock = threading.Lock()
+
+    cancelled = threading.Event()
+
+    def feed():
+        for job in jobs:
+            if cancelled.is_set():
+                break
+            queues[0].put(PipelineItem(job))
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+
+    def work(index, stage, remaining):
+        inbox, outbox = queues[index], queues[index + 1]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                with remaining["lock"]:
+                    remaining["count"] -= 1
+                    last = remaining["count"] == 0
+                if last:
+                    following = stages[index + 1].workers if index + 1 < len(stages) else 1
+                    for _ in range(following):
+                        outbox.put(_DONE)
+                return
+            if item.error is None and not cancelled.is_set():
+                start_time = time.perf_counter()
+                try:
+                    item.value = stage.fn(item.job, item.value)
+                except Exception as e:
+                    item.error = e
+                elapsed = time.perf_counter() - start_time
+                item.seconds += elapsed
+                with busy_lock:
+                    busy[stage.name] += elapsed
+            outbox.put(item)
+
+    threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+    for index, stage in enumerate(stages):
+        remaining = {"count": stage.workers, "lock": threading.Lock()}
+        threads.extend(
+            threading.Thread(target=work, args=(index, stage, remaining),
+                             name=f"pipeline-{stage.name}-{n}", daemon=True)
+            for n in range(stage.workers)
+        )
+    for thread in threads:
+        thread.start()
+
+    # Keep draining after a sink failure so no stage stays blocked on a full queue
+    sink_error = None
+    results = queues[-1]
+    while True:
+        item = results.get()
+        if item is _DONE:
+            break
+        if sink_error is None:
+            try:
+                sink(item)
+            except BaseException as e:
+                sink_error = e
+                cancelled.set()
+    for thread in threads:
+        thread.join()
+    if sink_error is not None:
+        raise sink_error
+    return dict(busy)
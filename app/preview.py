@@ -0,0 +1,171 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : preview.py
+# @Notice  : In-memory preview of one filled template
+
+"""
+Low-latency preview of a single filled document.
+
+The paragraphs of a template (its compiled copy when available) are parsed
+once and cached by path and mtime; a preview then only substitutes the
+placeholders of those cached texts, without python-docx and without writing
+anything to disk. The preview follows what generation does: placeholders are
+filled in header, body and footer paragraphs but not inside tables, and
+[date]/[date_du_jour]/[Fait_a] only in the body. Placeholders left unfilled
+are highlighted.
+"""
+
+import html
+import os
+import re
+import time
+import zipfile
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple
+
+from lxml import etree
+
+from template_compiler import PLACEHOLDER_PATTERN, lookup_compiled_template
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_PART_ORDER = (("header", re.compile(r"^word/header\d*\.xml$")),
+               ("body", re.compile(r"^word/document\.xml$")),
+               ("footer", re.compile(r"^word/footer\d*\.xml$")))
+MAX_EXCEL_ROWS = 200
+# Legacy .xls workbooks cannot be read by openpyxl
+PREVIEW_EXTENSIONS = (".docx", ".xlsx")
+
+
+class PreviewParagraph(NamedTuple):
+    part: str  # "header", "body", "footer" or the sheet name
+    in_table: bool
+    text: str
+
+
+class Preview(NamedTuple):
+    """A rendered preview"""
+
+    text: str
+    html: str
+    unresolved: List[str]
+    seconds: float
+
+
+def _paragraph_text(paragraph):
+    pieces = []
+    for element in paragraph.iter(W + "t", W + "tab", W + "br"):
+        if element.tag == W + "t":
+            pieces.append(element.text or "")
+        elif element.tag == W + "tab":
+            pieces.append("\t")
+        else:
+            pieces.append("\n")
+    return "".join(pieces)
+
+
+@lru_cache(maxsize=256)
+def _word_paragraphs(path, mtime_ns) -> Tuple[PreviewParagraph, ...]:
+    paragraphs = []
+    with zipfile.ZipFile(path) as docx:
+        names = docx.namelist()
+        for part, pattern in _PART_ORDER:
+            for name in sorted(n for n in names if pattern.match(n)):
+                root = etree.fromstring(docx.read(name))
+                for paragraph in root.iter(W + "p"):
+                    in_table = next(paragraph.iterancestors(W + "tc"), None) is not None
+                    paragraphs.append(PreviewParagraph(part, in_table, _paragraph_text(paragraph)))
+    return tuple(paragraphs)
+
+
+@lru_cache(maxsize=64)
+def _excel_paragraphs(path, mtime_ns) -> Tuple[PreviewParagraph, ...]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    rows = []
+    try:
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(max_row=MAX_EXCEL_ROWS, values_only=True):
+                cells = ["" if value is None else str(value) for value in row]
+                if any(cells):
+                    rows.append(PreviewParagraph(sheet.title, True, "\t".join(cells)))
+    finally:
+        workbook.close()
+    return tuple(rows)
+
+
+def template_paragraphs(template_folder_path, rel_path):
+    """Cached paragraphs of a template (compiled copy for Word when available)."""
+    path = os.path.join(template_folder_path, rel_path)
+    if rel_path.lower().endswith(".xlsx"):
+        return _excel_paragraphs(path, os.stat(path).st_mtime_ns)
+    compiled = lookup_compiled_template(path, template_folder_path)
+    if compiled is not None:
+        path = compiled[0]
+    return _word_paragraphs(path, os.stat(path).st_mtime_ns)
+
+
+def _date_and_place():
+    return {
+        "[date]": time.strftime("%d/%m/%Y"),
+        "[date_du_jour]": time.strftime("%d/%m/%Y"),
+        "[Fait_a]": "Arles",
+    }
+
+
+def render_preview(template_folder_path, rel_path, mapping_dict):
+    """Fill one template in memory and return its text and HTML rendering."""
+    start_time = time.perf_counter()
+    is_excel = rel_path.lower().endswith(".xlsx")
+    # Excel templates and Word body paragraphs also get date and place
+    body_mapping = dict(mapping_dict, **_date_and_place())
+
+    text_lines = []
+    html_lines = []
+    unresolved = []
+    current_part = None
+    for paragraph in template_paragraphs(template_folder_path, rel_path):
+        if is_excel:
+            mapping = body_mapping
+        elif paragraph.in_table:
+            mapping = {}
+        elif paragraph.part == "body":
+            mapping = body_mapping
+        else:
+            mapping = mapping_dict
+
+        text_pieces = []
+        html_pieces = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(paragraph.text):
+            before = paragraph.text[position:match.start()]
+            text_pieces.append(before)
+            html_pieces.append(html.escape(before))
+            placeholder = match.group()
+            if placeholder in mapping:
+                value = mapping[placeholder]
+                text_pieces.append(value)
+                html_pieces.append(f'<span style="background:#e6ffed">{html.escape(value)}</span>')
+            else:
+                unresolved.append(placeholder)
+                text_pieces.append(placeholder)
+                html_pieces.append(f'<mark style="background:#ffd6d6">{html.escape(placeholder)}</mark>')
+            position = match.end()
+        rest = paragraph.text[position:]
+        text_pieces.append(rest)
+        html_pieces.append(html.escape(rest))
+
+        if paragraph.part != current_part:
+            current_part = paragraph.part
+            html_lines.append(f"<h5>{html.escape(current_part)}</h5>")
+        text_lines.append("".join(text_pieces))
+        html_lines.append("<p>" + "".join(html_pieces).replace("\t", " &emsp; ")
+                          .replace("\n", "<br>") + "</p>")
+
+    return Preview(
+        text="\n".join(text_lines),
+        html="\n".join(html_lines),
+        unresolved=sorted(set(unresolved)),
+        seconds=time.perf_counter() - start_time,
+    )
@@ -0,0 +1,238 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : profiling.py
+# @Notice  : On-demand profiling of one generation run
+
+"""
+Profile a generation run across all of its threads.
+
+Two complementary views are captured:
+- deterministic: every function wrapped with RunProfiler.wrap (pipeline
+  stages, archive sink) runs under a per-thread cProfile, merged at the end
+  into a single pstats file. From Python 3.12 this profile is process-wide
+  instead: it covers every thread of the process, so profile.pstats also
+  holds the work of other sessions generating at the same time;
+- sampling: a background thread samples the stacks of the threads working
+  for this run (the one that started it, and pool threads while they run a
+  wrapped function) at a fixed interval and aggregates them as collapsed
+  stacks (flamegraph.pl / speedscope input), so time spent in lxml, openpyxl
+  or zipfile shows up with its full call path. Other sessions generating in
+  the same process are left out of the samples.
+
+The artifact is a zip with profile.pstats, stacks.collapsed and summary.txt.
+"""
+
+import collections
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import zipfile
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_TOP = 25
+# From 3.12 cProfile relies on sys.monitoring, which is process-wide: a single
+# profile enabled once then covers every thread, and only one can be active
+_GLOBAL_PROFILE = sys.version_info >= (3, 12)
+_global_profile_lock = threading.Lock()
+
+
+def _thread_group(name):
+    """Pool threads ("pipeline-load-3") are aggregated per stage."""
+    return re.sub(r"[-_]\d+$", "", name)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class RunProfiler:
+    """
+    Deterministic and sampling profiler for one run
+    sample_interval: seconds between stack samples (None disables sampling)
+    """
+
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self._local = threading.local()
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._stacks = collections.Counter()
+        self._active = collections.Counter()  # thread ident -> wrapped calls running
+        self._owns_global_profile = False
+        self.deterministic = True
+        # Whether the deterministic profile covered the whole process
+        self.process_wide = False
+        self._stop = threading.Event()
+        self._sampler = None
+        self.seconds = 0.0
+        self._start_time = None
+
+    def _thread_profile(self):
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            profile = cProfile.Profile()
+            self._local.profile = profile
+            with self._lock:
+                self._profiles.append(profile)
+        return profile
+
+    def _enter(self):
+        with self._lock:
+            self._active[threading.get_ident()] += 1
+
+    def _exit(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] -= 1
+            if self._active[thread_id] <= 0:
+                del self._active[thread_id]
+
+    def wrap(self, fn):
+        """Run fn under the profile of the calling thread, and sample that thread meanwhile."""
+
+        def profiled(*args, **kwargs):
+            self._enter()
+            profile = None
+            if not _GLOBAL_PROFILE:
+                profile = self._thread_profile()
+                profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                self._exit()
+        return profiled
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            with self._lock:
+                threads = set(self._active)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(_thread_group(names.get(thread_id, "thread")))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def _enable_global_profile(self):
+        """Enable the process-wide profile, unless another run already holds it."""
+        if not _global_profile_lock.acquire(blocking=False):
+            self.deterministic = False
+            return
+        try:
+            self._thread_profile().enable()
+        except ValueError:
+            # Another profiling tool (debugger, coverage) is active
+            _global_profile_lock.release()
+            self.deterministic = False
+            return
+        self._owns_global_profile = True
+        self.process_wide = True
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._enter()
+        if _GLOBAL_PROFILE:
+            self._enable_global_profile()
+        if self.sample_interval:
+            self._sampler = threading.Thread(target=self._sample, name="profiler-sampler",
+                                             daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._owns_global_profile:
+            self._thread_profile().disable()
+            self._owns_global_profile = False
+            _global_profile_lock.release()
+        self._exit()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.seconds = time.perf_counter() - self._start_time
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """Merged pstats.Stats of every profiled thread, or None."""
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def collapsed_stacks(self):
+        """Samples in collapsed-stack format, one "frame;frame;frame count" per line."""
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+
+    def top_functions(self, n=DEFAULT_TOP):
+        """Hottest functions by own time: dicts of function, calls, tottime, cumtime."""
+        stats = self.stats()
+        if stats is None:
+            return []
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            })
+        rows.sort(key=lambda row: row["tottime"], reverse=True)
+        return rows[:n]
+
+    def summary(self, n=DEFAULT_TOP):
+        lines = [f"Profiled run: {self.seconds:.2f} s, {sum(self._stacks.values())} stack samples", ""]
+        if not self.deterministic:
+            lines += ["Deterministic profile skipped: another profile was active in the process", ""]
+        if self.process_wide:
+            lines += ["Deterministic profile is process-wide: it includes other sessions "
+                      "generating during this run", ""]
+        stats = self.stats()
+        if stats is not None:
+            buffer = io.StringIO()
+            stats.stream = buffer
+            stats.sort_stats("tottime").print_stats(n)
+            lines.append(buffer.getvalue())
+        return "\n".join(lines)
+
+    def artifact_bytes(self, n=DEFAULT_TOP):
+        """Zip with profile.pstats, stacks.collapsed and summary.txt."""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as artifact:
+            stats = self.stats()
+            if stats is not None:
+                artifact.writestr("profile.pstats", _dump_stats(stats))
+            artifact.writestr("stacks.collapsed", self.collapsed_stacks() + "\n")
+            artifact.writestr("summary.txt", self.summary(n))
+        return buffer.getvalue()
+
+    def write_artifact(self, path, n=DEFAULT_TOP):
+        with open(path, "wb") as f:
+            f.write(self.artifact_bytes(n))
+        return path
+
+
+def _dump_stats(stats):
+    """Serialise a pstats.Stats the way Stats.dump_stats does, in memory."""
+    return marshal.dumps(stats.stats)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : record_store.py
+# @Notice  : Columnar store of normalised client records
+
+"""
+Client sheet converted once into a compact column store.
+
+Every column is normalised with vectorised pandas/NumPy operations, using the
+same rules as ingestion.normalise_value (blank cells empty, integral numbers
+without .0, dates dd/mm/YYYY, text stripped), then dictionary-encoded as
+integer codes into its distinct values. Mapping dicts of any subset of rows
+are materialised in bulk from the codes, without per-cell pandas lookups.
+
+A store built from a sheet on disk is cached next to it (<sheet>.records.npz)
+and reused while the sheet is unchanged.
+"""
+
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from ingestion import ClientRow, DATE_FORMAT, normalise_value, placeholder_columns
+
+STORE_VERSION = 1
+CACHE_SUFFIX = ".records.npz"
+_BLANK_WORDS = ["nan", "nat", "none"]
+# Beyond this, floats are not exactly representable as int64
+_MAX_EXACT_INTEGER = 2 ** 53
+
+
+def record_cache_path_for(sheet_path):
+    """Default cache location of the record store of a sheet."""
+    return sheet_path + CACHE_SUFFIX
+
+
+def normalise_column(series):
+    """Vectorised normalise_value over a column, as a str Series."""
+    values = series.infer_objects()
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime(DATE_FORMAT).fillna("")
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        return values.astype(str)
+    if pd.api.types.is_float_dtype(values):
+        text = values.astype(str)
+        integral = values.notna() & (np.mod(values, 1) == 0)
+        exact = integral & (values.abs() < _MAX_EXACT_INTEGER)
+        text[exact] = values[exact].astype("int64").astype(str)
+        text[integral & ~exact] = values[integral & ~exact].map(normalise_value)
+        text[values.isna()] = ""
+        return text
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        text = values.fillna("").astype(str).str.strip()
+        text[text.str.lower().isin(_BLANK_WORDS)] = ""
+        return text
+    # Mixed cells (text and numbers or dates in one column)
+    return values.map(normalise_value)
+
+
+class ClientRecordStore:
+    """
+    Normalised client rows, one dictionary-encoded array per column
+    index: DataFrame row index of each client (0 is the placeholder row)
+    columns: {column: (codes, values)}
+    placeholders: {placeholder: column}
+    """
+
+    def __init__(self, index, columns, placeholders):
+        self.index = np.asarray(index, dtype=np.int64)
+        self.columns = columns
+        self.placeholders = placeholders
+        self._positions = {row: position for position, row in enumerate(self.index.tolist())}
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Build the store from a client sheet read with its placeholder row."""
+        columns = [str(column) for column in df.columns]
+        if df.empty:
+            return cls([], {column: (np.zeros(0, np.int32), np.empty(0, object)) for column in columns}, {})
+        placeholders = placeholder_columns(columns, df.iloc[0].tolist())
+        clients = df.iloc[1:]
+        encoded = {}
+        for column, (_, series) in zip(columns, clients.items()):
+            codes, values = pd.factorize(normalise_column(series), sort=False)
+            encoded[column] = (codes.astype(np.int32), np.asarray(values, dtype=object))
+        return cls(clients.index.to_numpy(), encoded, placeholders)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, row):
+        return row in self._positions
+
+    def row_indexes(self) -> List[int]:
+        return self.index.tolist()
+
+    def _positions_of(self, rows):
+        if rows is None:
+            return np.arange(len(self.index))
+        try:
+            return np.fromiter((self._positions[row] for row in rows), dtype=np.int64)
+        except KeyError as e:
+            raise KeyError(f"row {e.args[0]} is not a client row of the sheet") from None
+
+    def _decode(self, column, positions):
+        codes, values = self.columns[column]
+        return values[codes[positions]].tolist()
+
+    def _materialise(self, keys, columns, positions):
+        decoded = [self._decode(column, positions) for column in columns]
+        return [dict(zip(keys, row)) for row in zip(*decoded)] if decoded else [{} for _ in positions]
+
+    def mappings(self, rows=None) -> List[Dict[str, str]]:
+        """{placeholder: value} of each row (all client rows by default)."""
+        keys = list(self.placeholders)
+        return self._materialise(keys, list(self.placeholders.values()), self._positions_of(rows))
+
+    def records(self, rows=None) -> List[Dict[str, str]]:
+        """{column: value} of each row (all client rows by default)."""
+        keys = list(self.columns)
+        return self._materialise(keys, keys, self._positions_of(rows))
+
+    def mapping(self, row):
+        return self.mappings([row])[0]
+
+    def record(self, row):
+        return self.records([row])[0]
+
+    def client_rows(self, rows=None) -> List[ClientRow]:
+        """The rows as ingestion.ClientRow, like a streamed sheet (blank rows skipped)."""
+        if rows is None:
+            rows = self.row_indexes()
+        return [ClientRow(row, record, mapping)
+                for row, record, mapping in zip(rows, self.records(rows), self.mappings(rows))
+                if any(record.values())]
+
+    def save(self, path, source_fingerprint=None):
+        """Write the store as an .npz (no pickled objects)."""
+        arrays = {"index": self.index}
+        for number, (codes, values) in enumerate(self.columns.values()):
+            arrays[f"codes_{number}"] = codes
+            arrays[f"values_{number}"] = np.array(values.tolist(), dtype=str)
+        meta = {
+            "version": STORE_VERSION,
+            "columns": list(self.columns),
+            "placeholders": self.placeholders,
+            "source": source_fingerprint,
+        }
+        arrays["meta"] = np.array(json.dumps(meta))
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, source_fingerprint=None):
+        """Load a saved store; None if missing, outdated or from another source."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != STORE_VERSION or meta.get("source") != source_fingerprint:
+                    return None
+                columns = {
+                    column: (data[f"codes_{number}"], data[f"values_{number}"].astype(object))
+                    for number, column in enumerate(meta["columns"])
+                }
+                return cls(data["index"], columns, meta["placeholders"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def read_client_dataframe(source, file_format="xlsx"):
+    """Raw client sheet as pandas reads it (CSV cells kept as text)."""
+    if file_format == "csv":
+        return pd.read_csv(source, dtype=str, keep_default_na=False)
+    return pd.read_excel(source)
+
+
+def _sheet_fingerprint(sheet_path):
+    stat = os.stat(sheet_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_client_records(sheet_path, cache_path=None, use_cache=True):
+    """Record store of a sheet file, reusing the cache while the sheet is unchanged."""
+    file_format = os.path.splitext(sheet_path)[1].lstrip(".").lower()
+    if cache_path is None:
+        cache_path = record_cache_path_for(sheet_path)
+    fingerprint = _sheet_fingerprint(sheet_path)
+    if use_cache:
+        store = ClientRecordStore.load(cache_path, fingerprint)
+        if store is not None:
+            return store
+    store = ClientRecordStore.from_dataframe(read_client_dataframe(sheet_path, file_format))
+    if use_cache:
+        try:
+            store.save(cache_path, fingerprint)
+        except OSError:
+            # The cache is an optimisation, never fail a run over it
+            pass
+    return store
@@ -1,22 +1,38 @@
+import argparse
 import os
-import re
+
+from template_scanner import scan_templates
 
 # We want to create a function that finds all the folders called "string_1" and replace
 # their name with "string_1" + "string_2" where "string_2" is the folder name
 # of the grandparent folder of "string_1"
 
 
-def replace_folder_root_name(root_path, string_1):
-    for dirpath, dirnames, filenames in os.walk(root_path):
-        for dirname in dirnames:
-            if dirname == string_1:
-                grandparent_folder = os.path.basename(dirpath)
-                grandparent_folder = grandparent_folder.split("_")[:2]
-                grandparent_folder = "_".join(grandparent_folder)
-                new_dirname = string_1 + "_" + grandparent_folder
-                os.rename(
-                    os.path.join(dirpath, dirname), os.path.join(dirpath, new_dirname)
-                )
+def replace_folder_root_name(root_path, string_1, dry_run=False):
+    renamed = []
+    # Deepest folders first so renaming a folder never invalidates a pending path
+    for directory in scan_templates(root_path).directories_deepest_first():
+        dirpath, dirname = os.path.split(os.path.join(root_path, directory))
+        if dirname == string_1:
+            grandparent_folder = os.path.basename(dirpath)
+            grandparent_folder = grandparent_folder.split("_")[:2]
+            grandparent_folder = "_".join(grandparent_folder)
+            new_dirname = string_1 + "_" + grandparent_folder
+            source = os.path.join(dirpath, dirname)
+            target = os.path.join(dirpath, new_dirname)
+            if dry_run:
+                print(f"Would rename: {source} -> {target}")
+            else:
+                os.rename(source, target)
+            renamed.append((source, target))
+    return renamed
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suffix folders with their parent indicator")
+    parser.add_argument("templates", nargs="?", default="app/templates copy")
+    parser.add_argument("folder_name", nargs="?", default="PREUVES_Mise_en_oeuvre")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
 
-replace_folder_root_name("app/templates copy", "PREUVES_Mise_en_oeuvre")
+    replace_folder_root_name(args.templates, args.folder_name, args.dry_run)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : scheduling.py
+# @Notice  : Cost estimates, longest-job-first ordering and worker sizing
+
+"""
+Cost-aware scheduling of template jobs.
+
+Each template's cost is its last measured processing time when the template
+is unchanged since, otherwise its size times the measured seconds per byte
+of its kind. Jobs are submitted most expensive first (LPT), so a huge
+template never starts last and leaves one worker running alone.
+
+The default worker count is the smallest of: available cores, the number of
+workers that can be kept busy (total cost / largest job), and the point where
+past runs stopped gaining speedup from extra workers.
+"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+
+TIMINGS_SUFFIX = "_timings.json"
+# Fallback when no run has been measured yet (seconds per byte of template)
+DEFAULT_SECONDS_PER_BYTE = {"word": 1 / 2_000_000, "excel": 1 / 1_000_000}
+SMOOTHING = 0.5  # weight of the newest measurement
+SPEEDUP_SATURATION = 0.9
+
+
+def timings_path_for(template_folder_path):
+    """Default location of the timing history of a template folder."""
+    return os.path.normpath(template_folder_path) + TIMINGS_SUFFIX
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class TimingHistory:
+    """
+    Per-template processing times and per-run speedups persisted as JSON
+    path: history file, created on first save
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.templates = {}
+        self.runs = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.templates = data.get("templates", {})
+            self.runs = data.get("runs", {})
+        except (OSError, ValueError):
+            pass
+
+    def record(self, template_file, seconds):
+        """Record the processing time of one template."""
+        with self._lock:
+            entry = self.templates.get(template_file.rel_path)
+            if entry is not None and entry["size"] == template_file.size:
+                seconds = SMOOTHING * seconds + (1 - SMOOTHING) * entry["seconds"]
+            self.templates[template_file.rel_path] = {
+                "seconds": seconds, "size": template_file.size, "kind": template_file.kind,
+            }
+
+    def record_run(self, workers, busy_seconds, wall_seconds):
+        """Record the speedup (busy time / wall time) reached with a worker count."""
+        if wall_seconds <= 0:
+            return
+        speedup = busy_seconds / wall_seconds
+        with self._lock:
+            previous = self.runs.get(str(workers))
+            if previous is not None:
+                speedup = SMOOTHING * speedup + (1 - SMOOTHING) * previous
+            self.runs[str(workers)] = speedup
+
+    def seconds_per_byte(self, kind):
+        with self._lock:
+            entries = [e for e in self.templates.values() if e["kind"] == kind]
+        sizes = [e["size"] for e in entries]
+        seconds = [e["seconds"] for e in entries]
+        if not sizes or sum(sizes) == 0:
+            return DEFAULT_SECONDS_PER_BYTE.get(kind, DEFAULT_SECONDS_PER_BYTE["word"])
+        return sum(seconds) / sum(sizes)
+
+    def saturation_workers(self):
+        """Fewest workers that reached SPEEDUP_SATURATION of the best speedup."""
+        with self._lock:
+            runs = dict(self.runs)
+        if not runs:
+            return None
+        best = max(runs.values())
+        return min(int(w) for w, s in runs.items() if s >= SPEEDUP_SATURATION * best)
+
+    def save(self):
+        with self._lock:
+            # Serialised under the lock: other dossiers keep recording meanwhile
+            text = json.dumps({"templates": self.templates, "runs": self.runs})
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(self.path) + ".", suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(self.path)),
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The history is an optimisation, never fail a run over it
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_timing_history(template_folder_path):
+    """Process-wide TimingHistory of a template folder."""
+    path = timings_path_for(template_folder_path)
+    with _histories_lock:
+        if path not in _histories:
+            _histories[path] = TimingHistory(path)
+        return _histories[path]
+
+
+def estimate_cost(template_file, history):
+    """Estimated processing seconds of a template."""
+    entry = history.templates.get(template_file.rel_path)
+    if entry is not None and entry["size"] == template_file.size:
+        return entry["seconds"]
+    return template_file.size * history.seconds_per_byte(template_file.kind)
+
+
+def longest_first(template_files, history):
+    """Template files ordered by decreasing estimated cost."""
+    return sorted(template_files, key=lambda f: estimate_cost(f, history), reverse=True)
+
+
+def default_worker_count(template_files, history, max_workers=None):
+    """Worker count that minimises the makespan without idle workers."""
+    workers = available_cores()
+    costs = [estimate_cost(f, history) for f in template_files]
+    if costs and max(costs) > 0:
+        # Beyond total / largest job, extra workers cannot shorten the run
+        workers = min(workers, math.ceil(sum(costs) / max(costs)))
+    saturation = history.saturation_workers()
+    if saturation is not None:
+        workers = min(workers, saturation + 1)
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return max(1, workers)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : service.py
+# @Notice  : Long-lived local HTTP generation service
+
+"""
+Local HTTP service generating dossiers without the Streamlit front end.
+
+Templates are scanned, compiled tables and static archive prepared, template
+bytes preloaded and the generation pipeline warmed by a throwaway run once at
+startup. Endpoints:
+
+    POST /generate          JSON {"mapping": {"[PLACEHOLDER]": "value", ...}}
+                            or   {"record": {"<column>": "value", ...}}
+                            (records need --mapping-sheet)
+    POST /generate/sheet    spreadsheet body (xlsx, or csv with ?format=csv),
+                            client row selected with ?row=N
+                            Both accept an indicator selection ("indicators"
+                            key or ?indicators=1,5), narrowed by the
+                            client's "Indicateurs" column
+    GET  /metrics           latency percentiles, counters and concurrency limit
+    GET  /health
+
+Generation endpoints return the dossier ZIP. Requests beyond the concurrency
+limit wait up to --queue-timeout seconds, then get a 503.
+
+Usage:
+    python service.py --templates templates --port 8765 --workers 4
+"""
+
+import argparse
+import collections
+import io
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from generation import client_folders, generate_dossier, preload_templates
+from static_archive import ensure_static_archive
+from template_compiler import load_compiled_table
+from template_scanner import scan_templates
+from scheduling import default_worker_count, get_timing_history
+from ingestion import normalise_value
+from workspace import default_workspace_root
+
+LATENCY_WINDOW = 1000
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of a list of numbers."""
+    if not values:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        rank = max(1, math.ceil(point / 100 * len(ordered)))
+        result[f"p{point}"] = ordered[rank - 1]
+    return result
+
+
+class GenerationService:
+    """
+    Generation state shared by all request threads
+    template_folder_path: template tree served
+    mappings: {placeholder: column} used to turn records into mappings
+    """
+
+    def __init__(self, template_folder_path, workers=4, max_concurrency=2,
+                 queue_timeout=30.0, mappings=None, logo_path=None):
+        self.template_folder_path = template_folder_path
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.mappings = mappings or {}
+        self.logo_path = logo_path
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._counters = collections.Counter()
+        self._in_flight = 0
+        self.startup_seconds = None
+        # Job directories live on tmpfs when available
+        self.workspace_root = default_workspace_root("service")
+        os.makedirs(self.workspace_root, exist_ok=True)
+
+    def warm_up(self):
+        """
+        Scan and preload templates, then run one throwaway generation so every
+        import, cache and code path of the pipeline is warm before the first request.
+        """
+        start_time = time.time()
+        inventory = scan_templates(self.template_folder_path)
+        ensure_static_archive(inventory)
+        load_compiled_table(self.template_folder_path)
+        preloaded = preload_templates(self.template_folder_path)
+        workspace = tempfile.mkdtemp(prefix="warmup_", dir=self.workspace_root)
+        try:
+            generate_dossier(self.template_folder_path, {},
+                             os.path.join(workspace, "warmup"), max_workers=self.workers,
+                             record_timings=False)
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+        self.startup_seconds = time.time() - start_time
+        print(f"Loaded {len(inventory)} template files ({preloaded / 1024:.0f} Ko) "
+              f"and {self.workers} workers in {self.startup_seconds:.2f} secondes")
+
+    def mapping_from_record(self, record):
+        if not self.mappings:
+            raise ValueError("records need a mapping sheet (--mapping-sheet)")
+        return {
+            key: normalise_value(record.get(column)) for key, column in self.mappings.items()
+        }
+
+    def generate(self, mapping_dict, name="dossier", folders=None):
+        """
+        Generate one dossier and return (zip bytes, result).
+        folders: only these top-level template folders (None: all)
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise OverflowError("concurrency limit reached")
+
+        start_time = time.time()
+        with self._lock:
+            self._in_flight += 1
+        workspace = tempfile.mkdtemp(prefix="dossier_", dir=self.workspace_root)
+        try:
+            safe_name = re.sub(r"[^\w.-]+", "_", name).strip("_") or "dossier"
+            output_folder_path = os.path.join(workspace, safe_name)
+            result = generate_dossier(
+                self.template_folder_path, mapping_dict, output_folder_path,
+                logo_path=self.logo_path, max_workers=self.workers, folders=folders,
+            )
+            with open(result["zip_path"], "rb") as f:
+                data = f.read()
+            with self._lock:
+                self._counters["requests"] += 1
+                self._counters["documents"] += result["total_files"]
+                self._counters["document_errors"] += len(result["errors"])
+                self._latencies.append(time.time() - start_time)
+            return data, result
+        except Exception:
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            metrics = {
+                "requests": self._counters["requests"],
+                "errors": self._counters["errors"],
+                "rejected": self._counters["rejected"],
+                "documents": self._counters["documents"],
+                "document_errors": self._counters["document_errors"],
+                "in_flight": self._in_flight,
+                "concurrency_limit": self.max_concurrency,
+                "workers": self.workers,
+                "startup_seconds": self.startup_seconds,
+            }
+        metrics["latency_seconds"] = percentiles(latencies)
+        metrics["latency_seconds"]["max"] = max(latencies) if latencies else None
+        metrics["latency_seconds"]["window"] = len(latencies)
+        return metrics
+
+
+def read_client_sheet(data, file_format="xlsx"):
+    """Read an uploaded client spreadsheet into a record_store.ClientRecordStore."""
+    from record_store import ClientRecordStore, read_client_dataframe
+
+    return ClientRecordStore.from_dataframe(read_client_dataframe(io.BytesIO(data), file_format))
+
+
+class GenerationHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a GenerationService (set as class attribute)"""
+
+    service: GenerationService = None
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"status": "ok"})
+        elif path == "/metrics":
+            self._send(200, self.service.metrics())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/generate":
+                payload = json.loads(self._read_body() or b"{}")
+                if "mapping" in payload:
+                    mapping_dict = {k: str(v) for k, v in payload["mapping"].items()}
+                else:
+                    mapping_dict = self.service.mapping_from_record(payload.get("record", {}))
+                name = payload.get("name") or mapping_dict.get("[NOM_ORGANISME]", "dossier")
+                folders = client_folders(self.service.template_folder_path,
+                                         payload.get("record"), payload.get("indicators"))
+            elif url.path == "/generate/sheet":
+                records = read_client_sheet(self._read_body(), query.get("format", ["xlsx"])[0])
+                row_index = int(query.get("row", ["1"])[0])
+                mapping_dict = records.mapping(row_index)
+                name = records.record(row_index).get("Nom de l'organisme") or "dossier"
+                folders = client_folders(self.service.template_folder_path, records.record(row_index),
+                                         query.get("indicators", [None])[0])
+            else:
+                self._send(404, {"error": "not found"})
+                return
+        except (ValueError, KeyError, IndexError) as e:
+            self._send(400, {"error": str(e)})
+            return
+
+        try:
+            data, result = self.service.generate(mapping_dict, name, folders)
+        except OverflowError as e:
+            self._send(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+
+        self._send(200, data, "application/zip", {
+            "Content-Disposition": f'attachment; filename="{os.path.basename(result["zip_path"])}"',
+            "X-Documents": str(result["total_files"]),
+            "X-Document-Errors": str(len(result["errors"])),
+            "X-Generation-Seconds": f"{result['seconds']:.3f}",
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(service, host="127.0.0.1", port=8765):
+    """Bind an HTTP server to a warmed-up service."""
+    handler = type("BoundGenerationHandler", (GenerationHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local dossier generation service")
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Pool size (default: from cores and measured template costs)")
+    parser.add_argument("--max-concurrency", type=int, default=2,
+                        help="Dossiers generated at the same time")
+    parser.add_argument("--queue-timeout", type=float, default=30.0,
+                        help="Seconds a request waits for a slot before a 503")
+    parser.add_argument("--mapping-sheet", default=None,
+                        help="Client spreadsheet whose first row maps placeholders to columns")
+    parser.add_argument("--logo", default=None)
+    args = parser.parse_args()
+
+    mappings = None
+    if args.mapping_sheet:
+        with open(args.mapping_sheet, "rb") as f:
+            file_format = "csv" if args.mapping_sheet.endswith(".csv") else "xlsx"
+            mappings = read_client_sheet(f.read(), file_format).placeholders
+
+    workers = args.workers
+    if workers is None:
+        inventory = scan_templates(args.templates)
+        workers = default_worker_count(
+            inventory.word_files() + inventory.excel_files(), get_timing_history(args.templates))
+
+    service = GenerationService(
+        args.templates, workers=workers, max_concurrency=args.max_concurrency,
+        queue_timeout=args.queue_timeout, mappings=mappings, logo_path=args.logo,
+    )
+    service.warm_up()
+    server = create_server(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
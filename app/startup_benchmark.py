@@ -0,0 +1,119 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : startup_benchmark.py
+# @Notice  : Cold import time per module, checked against a budget
+
+"""
+Measure the cold import time of the app entry points in fresh interpreters.
+
+Each module is imported with ``python -X importtime`` in a new process (the
+same cost a Streamlit process or a pool worker pays on start). The median
+cumulative time over several runs is compared with startup_budget.json, and
+the heaviest dependencies are listed to show where the time goes.
+
+Usage:
+    python startup_benchmark.py [--runs 5] [--top 5] [--budget startup_budget.json]
+Exits with status 1 when a module exceeds its budget.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET = os.path.join(APP_DIR, "startup_budget.json")
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_import(module):
+    """
+    Import a module in a fresh interpreter.
+    Returns (cumulative ms of the module, {top-level dependency: cumulative ms}).
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1:] or ["import failed"]
+        raise ImportError(f"{module}: {error[0]}")
+
+    total_ms = None
+    dependencies = {}
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        depth = len(match.group(3)) // 2
+        name = match.group(4)
+        if name == module and depth == 0:
+            total_ms = cumulative_ms
+        elif depth == 1:
+            dependencies[name] = dependencies.get(name, 0) + cumulative_ms
+    return total_ms or 0.0, dependencies
+
+
+def run_benchmark(modules, runs=5):
+    """Median import time and heaviest dependencies of each module."""
+    results = {}
+    for module in modules:
+        try:
+            samples = [measure_import(module) for _ in range(runs)]
+        except ImportError as e:
+            results[module] = {"error": str(e)}
+            continue
+        dependencies = {}
+        for _, sample_dependencies in samples:
+            for name, ms in sample_dependencies.items():
+                dependencies.setdefault(name, []).append(ms)
+        results[module] = {
+            "median_ms": statistics.median(total for total, _ in samples),
+            "dependencies_ms": {
+                name: statistics.median(values) for name, values in dependencies.items()
+            },
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start import benchmark")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5,
+                        help="Heaviest dependencies listed per module")
+    parser.add_argument("--json", action="store_true", help="Print raw results as JSON")
+    args = parser.parse_args()
+
+    with open(args.budget, encoding="utf-8") as f:
+        budget = json.load(f)
+
+    results = run_benchmark(list(budget), args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    over_budget = False
+    for module, limit_ms in budget.items():
+        result = results[module]
+        if "error" in result:
+            print(f"{module:<20} ERROR {result['error']}")
+            over_budget = True
+            continue
+        status = "ok" if result["median_ms"] <= limit_ms else "OVER BUDGET"
+        over_budget = over_budget or status != "ok"
+        print(f"{module:<20} {result['median_ms']:8.1f} ms / {limit_ms} ms  {status}")
+        heaviest = sorted(result["dependencies_ms"].items(), key=lambda x: x[1], reverse=True)
+        for name, ms in heaviest[:args.top]:
+            print(f"    {name:<30} {ms:8.1f} ms")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : static_archive.py
+# @Notice  : Prebuilt archive of the static part of the template tree
+
+"""
+Prebuilt, precompressed archive of the static template files.
+
+Everything in the template tree that is neither a Word nor an Excel template
+(``Consigne.txt``, images, PDFs...) is identical for every client. It is
+compressed once into ``<templates>_static.zip``; each dossier ZIP then gets
+those entries as raw compressed bytes (see ``utils.copy_raw_entries``), so
+the per-dossier cost only covers the filled documents.
+
+The archive comment is a small JSON manifest with the fingerprint of the
+static files of each top-level folder. The archive is rebuilt whenever a
+fingerprint changes; an inventory restricted to some folders (indicator
+selection) only checks, and only copies, the entries of those folders.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import zipfile
+
+from template_scanner import TemplateInventory, in_selection, scan_templates, top_folder
+from utils import entry_compress_type
+
+STATIC_ARCHIVE_SUFFIX = "_static.zip"
+STATIC_COMPRESSLEVEL = 9
+MANIFEST_VERSION = 2
+
+_build_lock = threading.Lock()
+
+
+def static_archive_path_for(template_folder_path):
+    """Default location of the static archive of a template folder."""
+    return os.path.normpath(template_folder_path) + STATIC_ARCHIVE_SUFFIX
+
+
+def static_fingerprint(inventory):
+    """Fingerprint of the static files of each top-level folder of an inventory."""
+    groups = {}
+    for template_file in inventory.static_files():
+        groups.setdefault(top_folder(template_file.rel_path), []).append(template_file)
+    return {
+        folder: TemplateInventory(inventory.root, files, ()).fingerprint()
+        for folder, files in sorted(groups.items())
+    }
+
+
+def _archive_fingerprint(archive_path):
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            manifest = json.loads(archive.comment.decode("utf-8"))
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest["folders"]
+
+
+def _up_to_date(archive_fingerprint, fingerprint, selection):
+    if archive_fingerprint is None:
+        return False
+    if selection is None:
+        return archive_fingerprint == fingerprint
+    return all(archive_fingerprint.get(folder) == fingerprint.get(folder)
+               for folder in ("",) + tuple(selection))
+
+
+def static_entry_filter(selection):
+    """Entry filter for utils.copy_raw_entries keeping the selected folders (None: all)."""
+    if selection is None:
+        return None
+    return lambda name: in_selection(name, selection)
+
+
+def build_static_archive(inventory, archive_path):
+    """Compress the static files of an inventory into archive_path."""
+    fingerprint = static_fingerprint(inventory)
+    directory = os.path.dirname(os.path.abspath(archive_path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".zip.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(
+            f, "w", zipfile.ZIP_DEFLATED,
+            compresslevel=STATIC_COMPRESSLEVEL, strict_timestamps=False,
+        ) as archive:
+            for template_file in inventory.static_files():
+                arcname = template_file.rel_path.replace(os.sep, "/")
+                archive.write(template_file.path, arcname,
+                              compress_type=entry_compress_type(arcname))
+            archive.comment = json.dumps(
+                {"version": MANIFEST_VERSION, "folders": fingerprint}).encode("utf-8")
+        os.replace(tmp_path, archive_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return archive_path
+
+
+def ensure_static_archive(inventory, archive_path=None):
+    """
+    Return the path of an up-to-date static archive for an inventory,
+    building it if it is missing or stale. For an inventory restricted to
+    some folders, only those folders are checked.
+    """
+    if archive_path is None:
+        archive_path = static_archive_path_for(inventory.root)
+    fingerprint = static_fingerprint(inventory)
+    if _up_to_date(_archive_fingerprint(archive_path), fingerprint, inventory.selection):
+        return archive_path
+    with _build_lock:
+        if not _up_to_date(_archive_fingerprint(archive_path), fingerprint, inventory.selection):
+            if inventory.selection is not None:
+                # The archive always holds the whole tree
+                inventory = scan_templates(inventory.root)
+            build_static_archive(inventory, archive_path)
+    return archive_path
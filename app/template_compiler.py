@@ -0,0 +1,282 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : template_compiler.py
+# @Notice  : Offline compilation of Word templates into run-normalised copies
+
+"""
+Compile Word templates so placeholders can be filled by direct substitution.
+
+Word routinely splits a placeholder such as ``[NOM_ORGANISME]`` across several
+runs (spell checking, revision ids, partial formatting). This script merges the
+runs of every placeholder into a single run, strips proofing and rsid noise and
+writes the compiled templates next to the source tree, in
+``<templates>_compiled`` where generation looks for them, together with a
+placeholder location table (``placeholders.json``) that tells the generator
+exactly which runs to touch.
+
+Usage:
+    python template_compiler.py templates
+"""
+
+import argparse
+import json
+import os
+import re
+import zipfile
+from functools import lru_cache
+
+from lxml import etree
+
+from template_scanner import scan_templates
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+W = "{%s}" % W_NS
+
+PLACEHOLDER_PATTERN = re.compile(r"\[[^\[\]\x00]+\]")
+COMPILED_SUFFIX = "_compiled"
+TABLE_NAME = "placeholders.json"
+TABLE_VERSION = 1
+
+# Marks a run boundary that a placeholder may not span (tabs, breaks, images)
+_BARRIER = "\x00"
+_SPLIT_BY_BARRIER = re.compile(r"\[[^\[\]]*\x00[^\[\]]*\]")
+_PART_PATTERN = re.compile(r"^word/(document|header\d*|footer\d*)\.xml$")
+_TEXT_RUN_CHILDREN = {W + "rPr", W + "t"}
+_NOISE_TAGS = (W + "proofErr",)
+
+
+def compiled_folder_for(template_folder_path):
+    """Default location of the compiled tree for a template folder."""
+    return os.path.normpath(template_folder_path) + COMPILED_SUFFIX
+
+
+def _is_text_run(run):
+    return all(child.tag in _TEXT_RUN_CHILDREN for child in run)
+
+
+def _run_text(run):
+    return "".join(t.text or "" for t in run.iter(W + "t"))
+
+
+def _set_run_text(run, text):
+    texts = list(run.iter(W + "t"))
+    if not texts:
+        texts = [etree.SubElement(run, W + "t")]
+    texts[0].text = text
+    texts[0].set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+    for extra in texts[1:]:
+        extra.getparent().remove(extra)
+
+
+def _strip_noise(root):
+    """Remove proofing marks and rsid attributes that fragment runs."""
+    for tag in _NOISE_TAGS:
+        for element in list(root.iter(tag)):
+            element.getparent().remove(element)
+    for element in root.iter():
+        for attribute in [a for a in element.attrib if a.startswith(W + "rsid")]:
+            del element.attrib[attribute]
+
+
+def _merge_paragraph(paragraph):
+    """
+    Merge the runs of every placeholder of a paragraph into its first run.
+    Returns False if a placeholder spans content that cannot be merged.
+    """
+    full_text = ""
+    boundaries = []
+    for child in paragraph:
+        if child.tag == W + "pPr":
+            continue
+        if child.tag == W + "r" and _is_text_run(child):
+            start = len(full_text)
+            full_text += _run_text(child)
+            boundaries.append((start, len(full_text), child))
+        elif child.tag == W + "r":
+            full_text += _BARRIER
+        else:
+            # Hyperlinks, fields, smart tags, revisions, content controls...:
+            # their runs are kept as they are, so a placeholder reaching into
+            # them (or split between them) is left to the generic replacement
+            nested = [_run_text(run) for run in child.iter(W + "r")]
+            full_text += _BARRIER + _BARRIER.join(nested) + _BARRIER
+
+    if not boundaries:
+        return _SPLIT_BY_BARRIER.search(full_text) is None
+
+    # Matches are processed from the end: merging only moves text between the
+    # runs of a match, so the boundaries of earlier runs stay valid
+    for match in reversed(list(PLACEHOLDER_PATTERN.finditer(full_text))):
+        start, end = match.span()
+        covering = [b for b in boundaries if b[0] < end and b[1] > start]
+        if len(covering) <= 1:
+            continue
+        first_start, _, first_run = covering[0]
+        last_start, _, last_run = covering[-1]
+        head = _run_text(first_run)[: start - first_start]
+        tail = _run_text(last_run)[end - last_start:]
+        _set_run_text(first_run, head + match.group())
+        for _, _, run in covering[1:-1]:
+            _set_run_text(run, "")
+        _set_run_text(last_run, tail)
+
+    for _, _, run in boundaries:
+        if not _run_text(run):
+            paragraph.remove(run)
+
+    return _SPLIT_BY_BARRIER.search(full_text) is None
+
+
+def _locate_placeholders(root):
+    """
+    Map run indexes (in document order) to the placeholders they contain.
+    Paragraphs inside tables are skipped, as they are by WordReplace.replace_doc.
+    """
+    locations = []
+    for index, run in enumerate(root.iter(W + "r")):
+        text = _run_text(run)
+        if "[" not in text:
+            continue
+        placeholders = PLACEHOLDER_PATTERN.findall(text)
+        if not placeholders:
+            continue
+        if next(run.iterancestors(W + "tc"), None) is not None:
+            continue
+        locations.append([index, sorted(set(placeholders))])
+    return locations
+
+
+def compile_part(xml_bytes):
+    """
+    Compile one WordprocessingML part.
+    Returns (compiled bytes, placeholder locations, fully_normalised).
+    """
+    root = etree.fromstring(xml_bytes)
+    _strip_noise(root)
+    normalised = True
+    for paragraph in root.iter(W + "p"):
+        if not _merge_paragraph(paragraph):
+            normalised = False
+    compiled = etree.tostring(
+        root, xml_declaration=True, encoding="UTF-8", standalone=True
+    )
+    return compiled, _locate_placeholders(root), normalised
+
+
+def compile_docx(source_path, output_path):
+    """
+    Compile a single .docx file.
+    Returns the location table entry for the template.
+    """
+    parts = {}
+    fallback = False
+    with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(
+        output_path, "w", zipfile.ZIP_DEFLATED
+    ) as target:
+        for info in source.infolist():
+            data = source.read(info.filename)
+            if _PART_PATTERN.match(info.filename):
+                data, locations, normalised = compile_part(data)
+                fallback = fallback or not normalised
+                if locations:
+                    parts["/" + info.filename] = locations
+            target.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+
+    stat = os.stat(source_path)
+    return {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "fallback": fallback,
+        "parts": parts,
+    }
+
+
+def compile_templates(template_folder_path):
+    """
+    Compile every Word template of a folder.
+    Writes the compiled tree (see compiled_folder_for) and its placeholder
+    table, returns the table.
+    """
+    output_folder_path = compiled_folder_for(template_folder_path)
+
+    templates = {}
+    for template_file in scan_templates(template_folder_path).word_files():
+        rel_path = template_file.rel_path
+        output_path = os.path.join(output_folder_path, rel_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        try:
+            templates[rel_path] = compile_docx(template_file.path, output_path)
+        except Exception as e:
+            print(f"Skipping {rel_path}: {str(e)}")
+
+    table = {"version": TABLE_VERSION, "templates": templates}
+    table_path = os.path.join(output_folder_path, TABLE_NAME)
+    os.makedirs(output_folder_path, exist_ok=True)
+    with open(table_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False)
+    os.replace(table_path + ".tmp", table_path)
+    return table
+
+
+@lru_cache(maxsize=8)
+def _load_table(table_path, mtime_ns):
+    with open(table_path, encoding="utf-8") as f:
+        table = json.load(f)
+    if table.get("version") != TABLE_VERSION:
+        return {}
+    return table.get("templates", {})
+
+
+def load_compiled_table(template_folder_path):
+    """Load the placeholder table of a template folder, or {} if not compiled."""
+    table_path = os.path.join(compiled_folder_for(template_folder_path), TABLE_NAME)
+    try:
+        mtime_ns = os.stat(table_path).st_mtime_ns
+    except OSError:
+        return {}
+    return _load_table(table_path, mtime_ns)
+
+
+def lookup_compiled_template(file_path, template_folder_path):
+    """
+    Return (compiled_path, locations) for an up-to-date compiled template,
+    or None when the generic replacement path must be used.
+    """
+    templates = load_compiled_table(template_folder_path)
+    if not templates:
+        return None
+    rel_path = os.path.relpath(file_path, template_folder_path)
+    entry = templates.get(rel_path)
+    if entry is None or entry["fallback"]:
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (entry["source_size"], entry["source_mtime_ns"]):
+        return None
+    compiled_path = os.path.join(compiled_folder_for(template_folder_path), rel_path)
+    if not os.path.exists(compiled_path):
+        return None
+    return compiled_path, entry["parts"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile Word templates")
+    parser.add_argument("templates", nargs="?", default="templates")
+    args = parser.parse_args()
+
+    table = compile_templates(args.templates)
+    templates = table["templates"]
+    fallback = [name for name, entry in templates.items() if entry["fallback"]]
+    placeholders = sum(
+        len(locations) for entry in templates.values() for locations in entry["parts"].values()
+    )
+    print(f"Compiled {len(templates)} templates ({placeholders} placeholder runs)")
+    for name in fallback:
+        print(f"Generic replacement kept for: {name}")
+
+
+if __name__ == "__main__":
+    main()
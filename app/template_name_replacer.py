@@ -1,7 +1,10 @@
+import argparse
 import os
 import re
 import unidecode
 
+from template_scanner import scan_templates
+
 
 def sanitize_name(name):
     # Remove accents
@@ -28,23 +31,36 @@ def sanitize_folder_name(name):
     return name
 
 
-def strip_spaces_and_sanitize_recursively(root_path):
-    for dirpath, dirnames, filenames in os.walk(root_path, topdown=False):
-        # Process files
-        for filename in filenames:
-            new_filename = sanitize_name(filename)
-            if new_filename != filename:
-                os.rename(
-                    os.path.join(dirpath, filename), os.path.join(dirpath, new_filename)
-                )
+def strip_spaces_and_sanitize_recursively(root_path, dry_run=False):
+    inventory = scan_templates(root_path)
+    renames = []
+
+    # Process files (their folders are renamed afterwards)
+    for template_file in inventory.files:
+        dirpath, filename = os.path.split(template_file.path)
+        new_filename = sanitize_name(filename)
+        if new_filename != filename:
+            renames.append((dirpath, filename, new_filename))
+
+    # Process directories, deepest first
+    for directory in inventory.directories_deepest_first():
+        dirpath, dirname = os.path.split(os.path.join(root_path, directory))
+        new_dirname = sanitize_folder_name(dirname)
+        if new_dirname != dirname:
+            renames.append((dirpath, dirname, new_dirname))
+
+    for dirpath, old_name, new_name in renames:
+        if dry_run:
+            print(f"Would rename: {os.path.join(dirpath, old_name)} -> {new_name}")
+        else:
+            os.rename(os.path.join(dirpath, old_name), os.path.join(dirpath, new_name))
+    return renames
 
-        # Process directories
-        for dirname in dirnames:
-            new_dirname = sanitize_folder_name(dirname)
-            if new_dirname != dirname:
-                os.rename(
-                    os.path.join(dirpath, dirname), os.path.join(dirpath, new_dirname)
-                )
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sanitize template file and folder names")
+    parser.add_argument("templates", nargs="?", default="templates")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
 
-strip_spaces_and_sanitize_recursively("templates")
+    strip_spaces_and_sanitize_recursively(args.templates, args.dry_run)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : template_scanner.py
+# @Notice  : Single os.scandir based inventory of the template tree
+
+"""
+Template tree inventory shared by discovery and maintenance code.
+
+The tree is scanned once with ``os.scandir`` and cached per directory. A
+directory listing is reused as long as the directory mtime is unchanged:
+adding, removing or renaming an entry (which is also how Office saves a
+document) bumps that mtime, so only the directories that changed are listed
+again on the next scan. Editing a file in place leaves the directory mtime
+alone, so the files of a reused listing are still stat-ed on every scan.
+
+A scan can be restricted to some top-level folders (the Indicateur_* folders,
+see select_folders), in which case the other subtrees are not even listed.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+WORD_EXTENSIONS = (".docx",)
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+INDICATOR_PREFIX = "Indicateur_"
+
+
+class TemplateFile(NamedTuple):
+    """A file of the template tree"""
+
+    path: str
+    rel_path: str
+    size: int
+    mtime_ns: int
+    kind: str  # "word", "excel", "static" or "lock" (Office ~$ files)
+
+
+class _DirectoryListing(NamedTuple):
+    mtime_ns: int
+    files: Tuple[TemplateFile, ...]
+    subdirs: Tuple[str, ...]
+
+
+def file_kind(name):
+    """Classify a template file by name."""
+    if name.startswith("~"):
+        return "lock"
+    lower = name.lower()
+    if lower.endswith(WORD_EXTENSIONS):
+        return "word"
+    if lower.endswith(EXCEL_EXTENSIONS):
+        return "excel"
+    return "static"
+
+
+def top_folder(rel_path):
+    """Top-level folder of a relative path ("" for files at the root)."""
+    parts = rel_path.replace(os.sep, "/").split("/", 1)
+    return parts[0] if len(parts) == 2 else ""
+
+
+def in_selection(rel_path, folders):
+    """Whether a path belongs to the selected top-level folders (None: all).
+    Files at the root of the tree are shared by every selection."""
+    if folders is None:
+        return True
+    folder = top_folder(rel_path)
+    return folder == "" or folder in folders
+
+
+def parse_selection(value):
+    """
+    Tokens of an indicator or folder selection, from a list or a text such as
+    "1, 5; Indicateur_7". None when nothing is selected (everything).
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = re.split(r"[,;\n]+", value)
+    tokens = tuple(str(token).strip() for token in value if str(token).strip())
+    return tokens or None
+
+
+def select_folders(root, selection) -> Optional[Tuple[str, ...]]:
+    """
+    Top-level folders of root matching a selection (see parse_selection):
+    "5" selects Indicateur_5_*, "Indicateur_5" or a full folder name select
+    that folder. Returns None when the selection is empty.
+    """
+    tokens = parse_selection(selection)
+    if tokens is None:
+        return None
+    with os.scandir(root) as entries:
+        folders = sorted(entry.name for entry in entries if entry.is_dir())
+    selected = []
+    unmatched = []
+    for token in tokens:
+        prefix = (INDICATOR_PREFIX + str(int(token)) if token.isdigit() else token).lower()
+        matches = [f for f in folders if f.lower() == prefix or f.lower().startswith(prefix + "_")]
+        if not matches:
+            unmatched.append(token)
+        selected.extend(f for f in matches if f not in selected)
+    if unmatched:
+        raise ValueError(f"no template folder matches {', '.join(unmatched)}")
+    return tuple(sorted(selected))
+
+
+class TemplateInventory:
+    """
+    Typed snapshot of a template tree
+    root: template folder the relative paths refer to
+    selection: top-level folders the scan was restricted to (None: all)
+    """
+
+    def __init__(self, root, files, directories, selection=None):
+        self.root = root
+        self.files: Tuple[TemplateFile, ...] = tuple(files)
+        self.directories: Tuple[str, ...] = tuple(directories)
+        self.selection: Optional[Tuple[str, ...]] = selection
+
+    def __len__(self):
+        return len(self.files)
+
+    def of_kind(self, *kinds) -> List[TemplateFile]:
+        return [f for f in self.files if f.kind in kinds]
+
+    def word_files(self) -> List[TemplateFile]:
+        return self.of_kind("word")
+
+    def excel_files(self) -> List[TemplateFile]:
+        return self.of_kind("excel")
+
+    def static_files(self) -> List[TemplateFile]:
+        return self.of_kind("static")
+
+    def directories_deepest_first(self) -> List[str]:
+        """Relative directory paths, children before their parents."""
+        return sorted(self.directories, key=lambda d: d.count(os.sep), reverse=True)
+
+    def fingerprint(self):
+        """Stable digest that changes whenever any file is added, removed or modified."""
+        digest = hashlib.sha1()
+        for f in self.files:
+            digest.update(f"{f.rel_path}\0{f.size}\0{f.mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+
+_cache: Dict[Tuple[str, str], Dict[str, _DirectoryListing]] = {}
+_cache_lock = threading.Lock()
+
+
+def _restat(previous):
+    """The previous listing with fresh file stats, or None if a file vanished."""
+    files = []
+    changed = False
+    for f in previous.files:
+        try:
+            stat = os.stat(f.path)
+        except FileNotFoundError:
+            return None
+        if stat.st_size != f.size or stat.st_mtime_ns != f.mtime_ns:
+            f = f._replace(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            changed = True
+        files.append(f)
+    return previous._replace(files=tuple(files)) if changed else previous
+
+
+def _list_directory(path, rel_path, previous):
+    """Read one directory, reusing the previous listing if no entry was added or removed."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    if previous is not None and previous.mtime_ns == mtime_ns:
+        listing = _restat(previous)
+        if listing is not None:
+            return listing
+
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            entry_rel = os.path.join(rel_path, entry.name) if rel_path else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry_rel)
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append(TemplateFile(
+                    entry.path, entry_rel, stat.st_size, stat.st_mtime_ns,
+                    file_kind(entry.name),
+                ))
+    return _DirectoryListing(mtime_ns, tuple(files), tuple(subdirs))
+
+
+def scan_templates(root, folders=None) -> TemplateInventory:
+    """
+    Return the (cached, incrementally refreshed) inventory of a template tree.
+    folders: only scan these top-level folders (and the files at the root)
+    """
+    key = (os.path.abspath(root), root)
+    with _cache_lock:
+        previous = _cache.get(key, {})
+        listings = {}
+        files = []
+        directories = []
+        pending = [""]
+        while pending:
+            rel_path = pending.pop()
+            path = os.path.join(root, rel_path) if rel_path else root
+            try:
+                listing = _list_directory(path, rel_path, previous.get(rel_path))
+            except FileNotFoundError:
+                continue
+            listings[rel_path] = listing
+            if rel_path:
+                directories.append(rel_path)
+            files.extend(listing.files)
+            subdirs = listing.subdirs
+            if not rel_path and folders is not None:
+                subdirs = [d for d in subdirs if d in folders]
+            pending.extend(reversed(subdirs))
+        if folders is not None:
+            # Keep the listings of the subtrees this scan skipped
+            listings = {**previous, **listings}
+        _cache[key] = listings
+    return TemplateInventory(root, files, directories, folders)
+
+
+def invalidate(root: Optional[str] = None):
+    """Drop the cached listings of one tree, or of every tree."""
+    with _cache_lock:
+        if root is None:
+            _cache.clear()
+        else:
+            path = os.path.abspath(root)
+            for key in [k for k in _cache if k[0] == path]:
+                del _cache[key]
+
@@ -0,0 +1,75 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : test_work_queue.py
+# @Notice  : Forced assembly of a queue with unfinished tasks
+
+"""
+Run from the app folder:
+    python -m unittest test_work_queue
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from docx import Document
+from openpyxl import Workbook
+
+from ingestion import ClientRow
+from work_queue import WorkQueue, _listdir, assemble, run_worker
+
+
+def _make_templates(root):
+    folder = os.path.join(root, "Indicateur_1_Info")
+    os.makedirs(folder)
+    for name in ("a", "b"):
+        document = Document()
+        document.add_paragraph(f"{name} [NOM]")
+        document.save(os.path.join(folder, f"{name}.docx"))
+    workbook = Workbook()
+    workbook.active["A1"] = "[NOM]"
+    workbook.save(os.path.join(folder, "c.xlsx"))
+    with open(os.path.join(folder, "Consigne.txt"), "w") as f:
+        f.write("consigne")
+
+
+class ForcedAssemblyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.templates = os.path.join(self.folder, "templates")
+        _make_templates(self.templates)
+        self.queue = os.path.join(self.folder, "queue")
+        self.output = os.path.join(self.folder, "docs")
+        client_row = ClientRow(1, {"Nom de l'organisme": "ACME"}, {"[NOM]": "ACME"})
+        WorkQueue(self.queue).enqueue([client_row], self.templates, self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_force_assembles_while_a_task_is_leased(self):
+        work_queue = WorkQueue(self.queue)
+        task, _ = work_queue.claim(_listdir(work_queue.folder("pending")), "other-host", 600)
+        run_worker(self.queue, worker_id="worker", wait=False)
+        self.assertEqual(work_queue.status()["leased"], 1)
+
+        summary = assemble(self.queue)
+        self.assertEqual(summary["incomplete"], ["ACME_1"])
+        self.assertEqual(summary["dossiers"], {})
+
+        summary = assemble(self.queue, force=True)
+        zip_path = summary["dossiers"]["ACME_1"]
+        self.assertFalse(os.path.exists(zip_path + ".tmp"))
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            names = set(zipf.namelist())
+        self.assertNotIn(task["rel_path"], names)
+        self.assertEqual(len([name for name in names if name.endswith((".docx", ".xlsx"))]), 2)
+        self.assertEqual(summary["errors"]["ACME_1"], [f"{task['id']}: missing, the task is not finished"])
+
+
+if __name__ == "__main__":
+    unittest.main()
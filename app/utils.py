@@ -1,34 +1,112 @@
 import os
+import copy
 import time
-import shutil
+import struct
 import zipfile
-from docx import Document
-from docx.shared import Inches
-import pandas as pd
-
-
-def zip_folder(folder_path, output_zip_path):
-    """Create a zip file from a folder."""
-    with zipfile.ZipFile(
-        output_zip_path, "w", zipfile.ZIP_DEFLATED, strict_timestamps=False
-    ) as zipf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(
-                    file_path, folder_path
-                )  # Preserve folder structure
-                zipf.write(file_path, arcname)
-
-
-def create_mapping_dict(df):
-    """Create a mapping dictionary from DataFrame."""
-    # Take the first row of the data frame and create a mapping dict {df.loc[] : column_name for column_name in df.columns}
-    # Select columns where the first row is not empty
-    non_empty_columns = df.loc[0].dropna().index
-    mapping_dict = {df.loc[0][key].strip(
-        " "): key for key in non_empty_columns}
-    return mapping_dict
+import zlib
+
+
+# Formats that are already deflate-compressed containers or compressed images
+STORED_EXTENSIONS = (
+    ".docx", ".xlsx", ".xlsm", ".pptx", ".odt", ".ods",
+    ".png", ".jpg", ".jpeg", ".gif", ".zip", ".pdf",
+)
+DEFAULT_COMPRESSLEVEL = 6
+
+
+def entry_compress_type(name):
+    """Compression method for a zip entry: store precompressed formats."""
+    if name.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def compress_entry(zinfo, data, compresslevel=DEFAULT_COMPRESSLEVEL):
+    """
+    Fill in zinfo for data and return its compressed bytes (thread-safe).
+    Precompressed formats, and data deflate would not shrink, are stored.
+    """
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    raw = data
+    zinfo.compress_type = zipfile.ZIP_STORED
+    if entry_compress_type(zinfo.filename) == zipfile.ZIP_DEFLATED:
+        # zlib releases the GIL, so entries compress in parallel on threads
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            raw = deflated
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.compress_size = len(raw)
+    return raw
+
+
+def prepare_bytes_entry(arcname, data, compresslevel=DEFAULT_COMPRESSLEVEL):
+    """ZipInfo and compressed bytes of in-memory data (thread-safe), for write_raw_entry."""
+    zinfo = zipfile.ZipInfo(arcname.replace(os.sep, "/"), time.localtime()[:6])
+    zinfo.external_attr = 0o644 << 16
+    return zinfo, compress_entry(zinfo, data, compresslevel)
+
+
+def write_bytes_entry(zipf, arcname, data, compresslevel=DEFAULT_COMPRESSLEVEL):
+    """Add in-memory data to a zip with the per-entry compression choice."""
+    write_raw_entry(zipf, *prepare_bytes_entry(arcname, data, compresslevel))
+
+
+def archive_stats(zipf, start_time):
+    """File count, raw and compressed bytes, ratio and seconds of a zip."""
+    raw_bytes = sum(zinfo.file_size for zinfo in zipf.infolist())
+    compressed_bytes = sum(zinfo.compress_size for zinfo in zipf.infolist())
+    return {
+        "files": len(zipf.infolist()),
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": compressed_bytes,
+        "ratio": compressed_bytes / raw_bytes if raw_bytes else 1.0,
+        "seconds": time.time() - start_time,
+    }
+
+
+def read_raw_entry(raw_file, zinfo):
+    """Read the compressed bytes of a zip entry from an open archive file."""
+    raw_file.seek(zinfo.header_offset)
+    header = raw_file.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header for {zinfo.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    raw_file.seek(zinfo.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    return raw_file.read(zinfo.compress_size)
+
+
+def write_raw_entry(zipf, zinfo, raw):
+    """
+    Append already compressed bytes to a zip opened for writing.
+    zinfo must carry the compress_type, CRC and sizes matching raw.
+    """
+    zinfo = copy.copy(zinfo)
+    # Sizes and CRC are known up front, so no trailing data descriptor
+    zinfo.flag_bits &= ~0x08
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader())
+    zipf.fp.write(raw)
+    zipf.start_dir = zipf.fp.tell()
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf._didModify = True
+
+
+def copy_raw_entries(source_zip_path, zipf, skip=None, include=None):
+    """
+    Copy every entry of an archive into zipf as raw compressed bytes.
+    include: optional filter on entry names
+    """
+    skip = set(zipf.NameToInfo) if skip is None else skip
+    with zipfile.ZipFile(source_zip_path) as source, open(source_zip_path, "rb") as raw_file:
+        for zinfo in source.infolist():
+            if zinfo.filename in skip or zinfo.is_dir():
+                continue
+            if include is not None and not include(zinfo.filename):
+                continue
+            write_raw_entry(zipf, zinfo, read_raw_entry(raw_file, zinfo))
 
 
 def set_date_and_place(doc):
@@ -52,6 +130,8 @@ def replace_first_image_in_header(
     doc, new_image_path="logo.png", width_inches=1, height_inches=1
 ):
     """Replace the first image in the header."""
+    from docx.shared import Inches
+
     for section in doc.sections:
         header = section.header
         for paragraph in header.paragraphs:
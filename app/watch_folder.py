@@ -0,0 +1,274 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : watch_folder.py
+# @Notice  : Daemon turning files dropped in an inbox into dossiers
+
+"""
+Hands-off generation from a watched inbox folder.
+
+The inbox is listed at every poll into a cheap (size, mtime) snapshot per
+file; the directory's own mtime is not trusted, since overwriting a file in
+place does not change it and coarse-mtime shared filesystems can miss new
+files. A file is picked up once its snapshot is unchanged between two polls
+(the copy is finished), and again whenever it is rewritten. Its content
+hash is then checked against the outbox index, so a file dropped twice, or
+renamed, is processed once.
+
+- client spreadsheets (.xlsx, .xls, .csv) generate one dossier per client
+  row into outbox/<name>_<hash>/ (see batch.py);
+- PDFs (conventions) go through PDFExtractor, the extracted fields are
+  written to outbox/<name>_<hash>.csv and .json.
+
+Files are processed by a bounded worker pool and every result is appended
+to outbox/index.jsonl.
+"""
+
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SPREADSHEET_EXTENSIONS = (".xlsx", ".xls", ".csv")
+PDF_EXTENSIONS = (".pdf",)
+INDEX_NAME = "index.jsonl"
+DEFAULT_INTERVAL = 2.0
+DEFAULT_WORKERS = 2
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def kind_of(name):
+    """"spreadsheet", "pdf" or None for files the daemon ignores."""
+    lower = name.lower()
+    if name.startswith((".", "~$")):
+        # Hidden, temporary and Office lock files
+        return None
+    if lower.endswith(SPREADSHEET_EXTENSIONS):
+        return "spreadsheet"
+    if lower.endswith(PDF_EXTENSIONS):
+        return "pdf"
+    return None
+
+
+class InboxWatcher:
+    """Detects files of the inbox that are new or changed and fully written"""
+
+    def __init__(self, inbox):
+        self.inbox = inbox
+        self._snapshot = {}  # name -> (size, mtime_ns) at the last poll
+        self._unstable = set()  # names whose snapshot changed at the last poll
+        self._reported = {}  # name -> snapshot already returned by poll
+
+    @property
+    def settling(self):
+        """Whether some files were still being written at the last poll."""
+        return bool(self._unstable)
+
+    def poll(self):
+        """Names of the files that became ready since the last poll."""
+        snapshot = {}
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if entry.is_file() and kind_of(entry.name) is not None:
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        ready = []
+        unstable = set()
+        for name, state in snapshot.items():
+            if self._reported.get(name) == state:
+                continue
+            if self._snapshot.get(name) == state:
+                ready.append(name)
+                self._reported[name] = state
+            else:
+                unstable.add(name)
+        self._reported = {name: state for name, state in self._reported.items() if name in snapshot}
+        self._snapshot = snapshot
+        self._unstable = unstable
+        return sorted(ready)
+
+
+class OutboxIndex:
+    """Append-only JSON lines index of the processed files"""
+
+    def __init__(self, outbox):
+        self.path = os.path.join(outbox, INDEX_NAME)
+        self._lock = threading.Lock()
+        self.hashes = set()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut short by a crash
+                        continue
+                    if entry.get("status") == "done":
+                        self.hashes.add(entry["sha256"])
+        except OSError:
+            pass
+
+    def append(self, entry):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if entry.get("status") == "done":
+                self.hashes.add(entry["sha256"])
+
+
+def process_spreadsheet(path, output_folder_path, template_folder_path, logo_path=None,
+                        max_workers=None):
+    """Generate the dossiers of every client of a spreadsheet. Returns output details."""
+    from batch import run_batch
+
+    summary = run_batch(path, template_folder_path, output_folder_path, logo_path=logo_path,
+                        max_workers=max_workers)
+    return {
+        "output": output_folder_path,
+        "dossiers": summary["dossiers"],
+        "documents": summary["documents"],
+        "errors": {str(row): error for row, error in summary["errors"].items()},
+    }
+
+
+def process_pdf(path, output_base_path):
+    """Extract the convention fields of a PDF into <output>.csv and .json."""
+    from pdf_extractor import PDFExtractor
+
+    extractor = PDFExtractor()
+    with open(path, "rb") as f:
+        text = extractor.extract_text_from_pdf(f)
+    if not text:
+        raise ValueError("no text could be extracted from the PDF")
+    fields = extractor.extract_all_fields(text)
+    with open(output_base_path + ".csv", "w", encoding="utf-8") as f:
+        f.write(extractor.export_to_csv(fields))
+    with open(output_base_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(fields, f, ensure_ascii=False, indent=2)
+    return {"output": output_base_path + ".csv", "fields": fields}
+
+
+class WatchFolderDaemon:
+    """
+    Watches inbox and processes ready files into outbox
+    workers: files processed at the same time
+    max_workers: threads per stage of each dossier generation
+    """
+
+    def __init__(self, inbox, outbox, template_folder_path, logo_path=None,
+                 workers=DEFAULT_WORKERS, max_workers=None, interval=DEFAULT_INTERVAL):
+        os.makedirs(outbox, exist_ok=True)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.template_folder_path = template_folder_path
+        self.logo_path = logo_path
+        self.workers = workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.watcher = InboxWatcher(inbox)
+        self.index = OutboxIndex(outbox)
+        self.stop_event = threading.Event()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        # A file waits in the inbox until a worker slot is free
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def _process(self, name, sha256):
+        path = os.path.join(self.inbox, name)
+        kind = kind_of(name)
+        output_base_path = os.path.join(self.outbox, f"{os.path.splitext(name)[0]}_{sha256[:8]}")
+        entry = {"file": name, "sha256": sha256, "kind": kind,
+                 "started": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        start_time = time.time()
+        try:
+            if kind == "spreadsheet":
+                entry.update(process_spreadsheet(path, output_base_path, self.template_folder_path,
+                                                 self.logo_path, self.max_workers))
+            else:
+                entry.update(process_pdf(path, output_base_path))
+            entry["status"] = "done"
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        finally:
+            entry["seconds"] = round(time.time() - start_time, 3)
+            self.index.append(entry)
+            with self._lock:
+                self._in_flight.discard(sha256)
+            self._slots.release()
+        print(f"{name}: {entry['status']} in {entry['seconds']:.2f} s")
+
+    def submit_ready(self, executor):
+        """Queue the ready files not processed yet. Returns how many were queued."""
+        queued = 0
+        for name in self.watcher.poll():
+            try:
+                sha256 = file_sha256(os.path.join(self.inbox, name))
+            except OSError:
+                # Removed or renamed since the poll
+                continue
+            with self._lock:
+                if sha256 in self.index.hashes or sha256 in self._in_flight:
+                    continue
+                self._in_flight.add(sha256)
+            while not self._slots.acquire(timeout=self.interval):
+                if self.stop_event.is_set():
+                    with self._lock:
+                        self._in_flight.discard(sha256)
+                    return queued
+            executor.submit(self._process, name, sha256)
+            queued += 1
+        return queued
+
+    def run(self, once=False):
+        """Poll until stopped (or, with once, until the current files are processed)."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="watch") as executor:
+            while not self.stop_event.is_set():
+                self.submit_ready(executor)
+                if once and not self.watcher.settling:
+                    break
+                self.stop_event.wait(self.interval)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate dossiers from files dropped in an inbox folder")
+    parser.add_argument("inbox")
+    parser.add_argument("outbox")
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--logo", default=None)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Files processed at the same time")
+    parser.add_argument("--generation-workers", type=int, default=None,
+                        help="Threads per stage of each dossier")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--once", action="store_true", help="Process the files present, then exit")
+    args = parser.parse_args()
+
+    daemon = WatchFolderDaemon(args.inbox, args.outbox, args.templates, logo_path=args.logo,
+                               workers=args.workers, max_workers=args.generation_workers,
+                               interval=args.interval)
+
+    def stop(signum, frame):
+        daemon.stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Watching {args.inbox} -> {args.outbox}")
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
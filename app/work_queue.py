@@ -0,0 +1,503 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : work_queue.py
+# @Notice  : Multi-node batch generation through a shared-filesystem work queue
+
+"""
+Sharded batch generation: one task per (client row, template), claimed by any
+number of worker processes on any number of hosts sharing a directory.
+
+Queue layout:
+    batch.json            templates, output folder, dossiers and their tasks
+    pending/<task>.json   tasks waiting for a worker
+    leased/<task>__<deadline>__<worker>
+                          claimed tasks; the lease deadline is in the name
+    leased/.<task>__<deadline>__<worker>
+                          released leases whose outcome is being recorded
+    done/<task>.json      completed tasks
+    failed/<task>.json    tasks that failed max_attempts times
+    results/<dossier>/    filled documents
+
+Every state change is a single os.rename, atomic on a POSIX shared
+filesystem, so two workers can never hold the same task. A worker renews its
+leases while it works; leases past their deadline (dead worker, lost host)
+are moved back to pending by any idle worker. Tasks are idempotent: filled
+documents are written to a private directory and renamed into results/. A
+worker first releases its lease (renames it to a hidden name) before recording
+an outcome; if the lease was already requeued, the outcome is dropped, so only
+the current holder of a task ever writes its state. Hosts are expected to have
+roughly synchronised clocks (NTP).
+
+Tasks are enqueued most expensive template first (see scheduling.py). Once
+all tasks are done, `assemble` zips each dossier and appends the static
+template entries.
+"""
+
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from generation import preload_templates, process_excel_document, process_word_document
+from scheduling import get_timing_history, longest_first
+from static_archive import ensure_static_archive, static_entry_filter
+from template_scanner import in_selection, scan_templates
+from utils import DEFAULT_COMPRESSLEVEL, archive_stats, copy_raw_entries, write_bytes_entry
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_SECONDS = 1.0
+STATES = ("pending", "leased", "done", "failed")
+_LEASE_SEPARATOR = "__"
+
+
+def _write_json(path, data):
+    """Write a JSON file atomically (hidden temporary file, then rename)."""
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, f".{name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _listdir(path):
+    """Visible entries of a queue directory (temporary files start with a dot)."""
+    return sorted(name for name in os.listdir(path) if not name.startswith("."))
+
+
+def default_worker_id():
+    return re.sub(r"[^A-Za-z0-9.-]+", "-", f"{socket.gethostname()}-{os.getpid()}")
+
+
+def _lease_name(task_id, deadline, worker_id):
+    return f"{task_id}{_LEASE_SEPARATOR}{int(deadline)}{_LEASE_SEPARATOR}{worker_id}"
+
+
+def _parse_lease(name):
+    task_id, deadline, worker_id = name.split(_LEASE_SEPARATOR, 2)
+    return task_id, int(deadline), worker_id
+
+
+class WorkQueue:
+    """A batch queue directory on a (possibly shared) filesystem"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def folder(self, state):
+        return os.path.join(self.path, state)
+
+    def batch(self):
+        return _read_json(os.path.join(self.path, "batch.json"))
+
+    def status(self):
+        """Number of tasks in each state."""
+        return {state: len(_listdir(self.folder(state))) for state in STATES}
+
+    def enqueue(self, client_rows, template_folder_path, output_folder_path, logo_path=None,
+                lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                indicators=None):
+        """
+        Write one task per (client row, template).
+        client_rows: ingestion.ClientRow objects (e.g. from a record store)
+        indicators: indicators or folders to generate, narrowed per client by
+        its "Indicateurs" column (see generation.client_folders); clients
+        whose selection is invalid or empty get no tasks and are listed in
+        the "errors" of batch.json
+        Returns the number of tasks.
+        """
+        from batch import dossier_name_for
+        from generation import client_folders
+
+        for state in STATES + ("results",):
+            os.makedirs(self.folder(state), exist_ok=True)
+        if any(_listdir(self.folder(state)) for state in STATES):
+            raise ValueError(f"{self.path} already holds a batch, use a new queue directory")
+
+        inventory = scan_templates(template_folder_path)
+        template_files = longest_first(inventory.word_files() + inventory.excel_files(),
+                                       get_timing_history(template_folder_path))
+        dossiers = {}
+        errors = {}
+        count = 0
+        for client_row in client_rows:
+            dossier = dossier_name_for(client_row)
+            try:
+                folders = client_folders(template_folder_path, client_row.record, indicators)
+            except ValueError as e:
+                errors[dossier] = str(e)
+                continue
+            task_ids = []
+            for rank, template_file in enumerate(template_files):
+                if not in_selection(template_file.rel_path, folders):
+                    continue
+                # Sorted names follow the cost order across all dossiers
+                task_id = f"{rank:04d}-{client_row.index:07d}"
+                _write_json(os.path.join(self.folder("pending"), task_id + ".json"), {
+                    "id": task_id,
+                    "dossier": dossier,
+                    "row": client_row.index,
+                    "kind": template_file.kind,
+                    "rel_path": template_file.rel_path,
+                    "mapping": client_row.mapping,
+                    "attempts": 0,
+                })
+                task_ids.append(task_id)
+            dossiers[dossier] = {"row": client_row.index, "tasks": task_ids,
+                                 "folders": list(folders) if folders is not None else None}
+            count += len(task_ids)
+
+        _write_json(os.path.join(self.path, "batch.json"), {
+            "templates": os.path.abspath(template_folder_path),
+            "output": os.path.abspath(output_folder_path),
+            "logo": os.path.abspath(logo_path) if logo_path else None,
+            "lease_seconds": lease_seconds,
+            "max_attempts": max_attempts,
+            "dossiers": dossiers,
+            "errors": errors,
+        })
+        return count
+
+    def claim(self, names, worker_id, lease_seconds):
+        """Lease the first claimable task among pending names: (task, lease name) or None."""
+        for name in names:
+            task_id = name[:-len(".json")]
+            lease = _lease_name(task_id, time.time() + lease_seconds, worker_id)
+            try:
+                os.rename(os.path.join(self.folder("pending"), name),
+                          os.path.join(self.folder("leased"), lease))
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+            return _read_json(os.path.join(self.folder("leased"), lease)), lease
+        return None
+
+    def renew(self, lease, lease_seconds):
+        """Extend a lease; returns the new lease name, or None if it was lost."""
+        task_id, _, worker_id = _parse_lease(lease)
+        renewed = _lease_name(task_id, time.time() + lease_seconds, worker_id)
+        try:
+            os.rename(os.path.join(self.folder("leased"), lease),
+                      os.path.join(self.folder("leased"), renewed))
+        except FileNotFoundError:
+            return None
+        return renewed
+
+    def requeue_expired(self):
+        """Move leases past their deadline back to pending. Returns how many."""
+        now = time.time()
+        count = 0
+        # Hidden names are released leases of workers that died before
+        # recording the outcome
+        for lease in sorted(os.listdir(self.folder("leased"))):
+            task_id, deadline, _ = _parse_lease(lease.lstrip("."))
+            if deadline >= now:
+                continue
+            try:
+                os.rename(os.path.join(self.folder("leased"), lease),
+                          os.path.join(self.folder("pending"), task_id + ".json"))
+                count += 1
+            except FileNotFoundError:
+                pass
+        return count
+
+    def release(self, lease, lease_seconds):
+        """
+        Take a lease out of reach of requeue_expired before recording the
+        outcome of its task. Returns the released name, or None if the lease
+        was lost (expired and requeued: another worker now owns the task).
+        """
+        task_id, _, worker_id = _parse_lease(lease)
+        released = "." + _lease_name(task_id, time.time() + lease_seconds, worker_id)
+        try:
+            os.rename(os.path.join(self.folder("leased"), lease),
+                      os.path.join(self.folder("leased"), released))
+        except FileNotFoundError:
+            return None
+        return released
+
+    def complete(self, task, released, record):
+        """Record a task as done; released comes from release()."""
+        _write_json(os.path.join(self.folder("done"), task["id"] + ".json"), record)
+        os.remove(os.path.join(self.folder("leased"), released))
+
+    def fail(self, task, released, error, max_attempts):
+        """Requeue a failed task, or park it in failed/ after max_attempts."""
+        task = dict(task, attempts=task["attempts"] + 1, error=error)
+        state = "failed" if task["attempts"] >= max_attempts else "pending"
+        _write_json(os.path.join(self.folder(state), task["id"] + ".json"), task)
+        os.remove(os.path.join(self.folder("leased"), released))
+
+
+class _LeaseKeeper:
+    """Background renewal of the lease held by a worker"""
+
+    def __init__(self, work_queue, lease, lease_seconds):
+        self.work_queue = work_queue
+        self.lease = lease
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                if self.lease is None:
+                    return
+                self.lease = self.work_queue.renew(self.lease, self.lease_seconds)
+
+    def stop(self):
+        """Stop renewing; returns the current lease name (None if lost)."""
+        self._stop.set()
+        with self._lock:
+            lease = self.lease
+            self.lease = None
+        self._thread.join()
+        return lease
+
+
+def _run_task(task, batch, private_folder):
+    """Fill one template into private_folder; returns (success, message)."""
+    template_folder_path = batch["templates"]
+    file_path = os.path.join(template_folder_path, task["rel_path"])
+    output_folder_path = os.path.join(private_folder, task["dossier"])
+    if task["kind"] == "word":
+        return process_word_document(
+            (file_path, task["mapping"], batch["logo"], template_folder_path, output_folder_path))
+    return process_excel_document((file_path, task["mapping"], template_folder_path, output_folder_path))
+
+
+def run_worker(queue_path, worker_id=None, lease_seconds=None, wait=True, poll_seconds=POLL_SECONDS):
+    """
+    Claim and run tasks until the queue is drained.
+    wait: keep polling while other workers hold leases (their tasks may be
+    requeued), instead of exiting as soon as nothing is pending
+    Returns a dict with done, failed, lost (leases reclaimed by other
+    workers before the task finished) and seconds.
+    """
+    start_time = time.time()
+    work_queue = WorkQueue(queue_path)
+    batch = work_queue.batch()
+    worker_id = worker_id or default_worker_id()
+    lease_seconds = lease_seconds or batch["lease_seconds"]
+    private_folder = os.path.join(work_queue.folder("results"), f".{worker_id}")
+    preload_templates(batch["templates"])
+
+    counts = {"done": 0, "failed": 0, "lost": 0}
+    names = []
+    while True:
+        if not names:
+            work_queue.requeue_expired()
+            names = _listdir(work_queue.folder("pending"))
+        claimed = work_queue.claim(names, worker_id, lease_seconds)
+        if claimed is None:
+            names = []
+            if not wait or not _listdir(work_queue.folder("leased")):
+                break
+            time.sleep(poll_seconds)
+            continue
+        task, lease = claimed
+        names = names[names.index(task["id"] + ".json") + 1:]
+
+        keeper = _LeaseKeeper(work_queue, lease, lease_seconds)
+        task_start = time.perf_counter()
+        try:
+            success, message = _run_task(task, batch, private_folder)
+        except Exception as e:
+            success, message = False, str(e)
+        lease = keeper.stop()
+        released = work_queue.release(lease, lease_seconds) if lease is not None else None
+        produced = os.path.join(private_folder, task["dossier"], task["rel_path"])
+
+        if released is None:
+            # The task was requeued meanwhile and belongs to another worker now
+            if os.path.exists(produced):
+                os.remove(produced)
+            counts["lost"] += 1
+        elif success:
+            published = os.path.join(work_queue.folder("results"), task["dossier"], task["rel_path"])
+            os.makedirs(os.path.dirname(published), exist_ok=True)
+            os.replace(produced, published)
+            work_queue.complete(task, released, {
+                "id": task["id"], "dossier": task["dossier"], "rel_path": task["rel_path"],
+                "worker": worker_id, "seconds": time.perf_counter() - task_start,
+            })
+            counts["done"] += 1
+        else:
+            work_queue.fail(task, released, message, batch["max_attempts"])
+            counts["failed"] += 1
+
+    shutil.rmtree(private_folder, ignore_errors=True)
+    counts["seconds"] = time.time() - start_time
+    return counts
+
+
+def _assemble_dossier(work_queue, batch, dossier, static_archive_path, compresslevel):
+    template_folder_path = batch["templates"]
+    results_folder = os.path.join(work_queue.folder("results"), dossier)
+    zip_path = os.path.join(batch["output"], dossier + ".zip")
+    # Built aside and renamed, so a failed assembly never leaves a truncated zip
+    tmp_path = zip_path + ".tmp"
+    errors = []
+    start_time = time.time()
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, strict_timestamps=False) as zipf:
+        for task_id in batch["dossiers"][dossier]["tasks"]:
+            done_path = os.path.join(work_queue.folder("done"), task_id + ".json")
+            failed_path = os.path.join(work_queue.folder("failed"), task_id + ".json")
+            # A task can end up in both after a lease was reclaimed: a success wins
+            if os.path.exists(done_path):
+                task = _read_json(done_path)
+                source = os.path.join(results_folder, task["rel_path"])
+            elif not os.path.exists(failed_path):
+                # Still pending or leased (forced assembly)
+                errors.append(f"{task_id}: missing, the task is not finished")
+                continue
+            else:
+                task = _read_json(failed_path)
+                errors.append(f"{task['rel_path']}: {task.get('error')}")
+                if task["kind"] != "excel":
+                    continue
+                # Ship the original template, as generate_dossier does
+                source = os.path.join(template_folder_path, task["rel_path"])
+            with open(source, "rb") as f:
+                write_bytes_entry(zipf, task["rel_path"], f.read(), compresslevel)
+        folders = batch["dossiers"][dossier].get("folders")
+        copy_raw_entries(static_archive_path, zipf,
+                         include=static_entry_filter(tuple(folders) if folders is not None else None))
+        zip_stats = archive_stats(zipf, start_time)
+    os.replace(tmp_path, zip_path)
+    return zip_path, errors, zip_stats
+
+
+def assemble(queue_path, compresslevel=DEFAULT_COMPRESSLEVEL, max_workers=None, force=False):
+    """
+    Zip every finished dossier into the output folder.
+    force: also assemble dossiers whose tasks are not all done or failed
+    Returns a dict with dossiers (name -> zip path), errors, incomplete and seconds.
+    """
+    start_time = time.time()
+    work_queue = WorkQueue(queue_path)
+    batch = work_queue.batch()
+    os.makedirs(batch["output"], exist_ok=True)
+    static_archive_path = ensure_static_archive(scan_templates(batch["templates"]))
+
+    finished = {name[:-len(".json")] for name in _listdir(work_queue.folder("done"))}
+    finished.update(name[:-len(".json")] for name in _listdir(work_queue.folder("failed")))
+    ready = []
+    incomplete = []
+    for dossier, entry in batch["dossiers"].items():
+        if force or all(task_id in finished for task_id in entry["tasks"]):
+            ready.append(dossier)
+        else:
+            incomplete.append(dossier)
+
+    summary = {"dossiers": {}, "errors": {}, "incomplete": incomplete}
+    # Clients left out at enqueue time (invalid or empty indicator selection)
+    for dossier, error in batch.get("errors", {}).items():
+        summary["errors"][dossier] = [error]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            dossier: executor.submit(_assemble_dossier, work_queue, batch, dossier,
+                                     static_archive_path, compresslevel)
+            for dossier in ready
+        }
+        for dossier, future in futures.items():
+            zip_path, errors, _ = future.result()
+            summary["dossiers"][dossier] = zip_path
+            if errors:
+                summary["errors"][dossier] = errors
+    summary["seconds"] = time.time() - start_time
+    return summary
+
+
+def _worker_process(queue_path, lease_seconds, wait):
+    result = run_worker(queue_path, lease_seconds=lease_seconds, wait=wait)
+    print(f"worker {default_worker_id()}: {result['done']} done, {result['failed']} failed, "
+          f"{result['lost']} lost in {result['seconds']:.2f} s")
+
+
+def main():
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Multi-node batch generation through a shared work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Create the tasks of a batch")
+    enqueue_parser.add_argument("queue")
+    enqueue_parser.add_argument("sheet", help="Client spreadsheet (csv, xlsx or xls)")
+    enqueue_parser.add_argument("--templates", default="templates")
+    enqueue_parser.add_argument("--output", default="docs")
+    enqueue_parser.add_argument("--rows", type=int, nargs="*", default=None)
+    enqueue_parser.add_argument("--logo", default=None)
+    enqueue_parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS,
+                                help="Lease duration in seconds")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    enqueue_parser.add_argument("--indicators", default=None,
+                                help='Indicators or folders to generate, e.g. "1,5" (default: all)')
+
+    worker_parser = commands.add_parser("worker", help="Run tasks until the queue is drained")
+    worker_parser.add_argument("queue")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Worker processes on this host")
+    worker_parser.add_argument("--lease", type=int, default=None)
+    worker_parser.add_argument("--no-wait", action="store_true",
+                               help="Exit when nothing is pending, even if leases are still held")
+
+    assemble_parser = commands.add_parser("assemble", help="Zip the finished dossiers")
+    assemble_parser.add_argument("queue")
+    assemble_parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL)
+    assemble_parser.add_argument("--workers", type=int, default=None)
+    assemble_parser.add_argument("--force", action="store_true",
+                                 help="Also assemble dossiers with unfinished tasks")
+
+    status_parser = commands.add_parser("status", help="Count the tasks in each state")
+    status_parser.add_argument("queue")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        from record_store import load_client_records
+
+        records = load_client_records(args.sheet)
+        rows = [row for row in args.rows if row in records] if args.rows is not None else None
+        work_queue = WorkQueue(args.queue)
+        count = work_queue.enqueue(
+            records.client_rows(rows), args.templates, args.output, logo_path=args.logo,
+            lease_seconds=args.lease, max_attempts=args.max_attempts, indicators=args.indicators)
+        for dossier, error in work_queue.batch()["errors"].items():
+            print(f"{dossier}: {error}")
+        print(f"{count} tasks enqueued in {args.queue}")
+    elif args.command == "worker":
+        processes = [
+            multiprocessing.Process(target=_worker_process, args=(args.queue, args.lease, not args.no_wait))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == "assemble":
+        summary = assemble(args.queue, args.compresslevel, args.workers, args.force)
+        for dossier, errors in summary["errors"].items():
+            for error in errors:
+                print(f"{dossier}: {error}")
+        print(f"{len(summary['dossiers'])} dossiers assembled in {summary['seconds']:.2f} s, "
+              f"{len(summary['incomplete'])} incomplete")
+    else:
+        print(json.dumps(WorkQueue(args.queue).status()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python 3.9
+# -*- coding: utf-8 -*-
+# @Author  : Document Filler
+# @File    : workspace.py
+# @Notice  : Isolated per-session workspaces with quota and TTL/LRU eviction
+
+"""
+Per-session working directories.
+
+Each Streamlit session gets its own directory for the uploaded logo and
+generated dossiers, on a RAM-backed tmpfs (/dev/shm) when one is available
+with enough room. Every consumer of that tmpfs (the app, the HTTP service,
+the load test) works in its own subdirectory of the root, so the app's
+eviction never removes a directory another process is still using. The last use of a workspace is its
+directory mtime; workspaces idle for longer than the TTL are evicted, and
+beyond max_workspaces the least recently used ones go first. Within a
+workspace, the oldest dossiers are removed once the disk quota is exceeded.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+TMPFS_ROOT = "/dev/shm"
+WORKSPACE_DIR_NAME = "document_filler"
+DEFAULT_TTL_SECONDS = 2 * 3600
+DEFAULT_MAX_WORKSPACES = 50
+DEFAULT_QUOTA_BYTES = 512 * 1024 * 1024
+EVICTION_INTERVAL_SECONDS = 60
+
+
+def default_workspace_root(consumer, min_free_bytes=DEFAULT_QUOTA_BYTES):
+    """
+    Scratch directory of a consumer ("app", "service", "load_test"): on tmpfs
+    when available with min_free_bytes free, else in the temp dir.
+    """
+    base = tempfile.gettempdir()
+    if os.path.isdir(TMPFS_ROOT) and os.access(TMPFS_ROOT, os.W_OK):
+        stat = os.statvfs(TMPFS_ROOT)
+        if stat.f_bavail * stat.f_frsize >= min_free_bytes:
+            base = TMPFS_ROOT
+    return os.path.join(base, WORKSPACE_DIR_NAME, consumer)
+
+
+def directory_size(path):
+    """Total size in bytes of the files below a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """
+    Creates, tracks and evicts per-session workspaces
+    root: directory holding one subdirectory per session
+    """
+
+    def __init__(self, root=None, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_workspaces=DEFAULT_MAX_WORKSPACES, quota_bytes=DEFAULT_QUOTA_BYTES):
+        self.root = root or default_workspace_root("app", quota_bytes)
+        self.ttl_seconds = ttl_seconds
+        self.max_workspaces = max_workspaces
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    def path(self, session_id):
+        return os.path.join(self.root, session_id)
+
+    def workspace(self, session_id):
+        """Return the (created and touched) workspace of a session."""
+        self.maybe_evict(exclude=(session_id,))
+        path = self.path(session_id)
+        os.makedirs(path, exist_ok=True)
+        self.touch(session_id)
+        return path
+
+    def touch(self, session_id):
+        try:
+            os.utime(self.path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def usage(self, session_id):
+        return directory_size(self.path(session_id))
+
+    def enforce_quota(self, session_id, keep=()):
+        """
+        Remove the oldest entries of a workspace until it fits in the quota.
+        keep: entry names never removed (e.g. the dossier just generated)
+        Returns the removed entry names.
+        """
+        path = self.path(session_id)
+        if not os.path.isdir(path):
+            return []
+        entries = []
+        with os.scandir(path) as scanned:
+            for entry in scanned:
+                if entry.name in keep:
+                    continue
+                size = (directory_size(entry.path) if entry.is_dir(follow_symlinks=False)
+                        else entry.stat(follow_symlinks=False).st_size)
+                entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.name, size))
+
+        usage = self.usage(session_id)
+        removed = []
+        for _, name, size in sorted(entries):
+            if usage <= self.quota_bytes:
+                break
+            self._remove(os.path.join(path, name))
+            usage -= size
+            removed.append(name)
+        return removed
+
+    def release(self, session_id):
+        """Delete a session workspace."""
+        self._remove(self.path(session_id))
+
+    def maybe_evict(self, exclude=()):
+        """Run evict() at most once per EVICTION_INTERVAL_SECONDS."""
+        now = time.time()
+        if now - self._last_eviction < EVICTION_INTERVAL_SECONDS:
+            return []
+        self._last_eviction = now
+        return self.evict(exclude)
+
+    def evict(self, exclude=()):
+        """
+        Remove workspaces idle for longer than the TTL, then the least recently
+        used ones beyond max_workspaces. Returns the evicted session ids.
+        """
+        with self._lock:
+            now = time.time()
+            workspaces = []
+            with os.scandir(self.root) as scanned:
+                for entry in scanned:
+                    if entry.is_dir(follow_symlinks=False) and entry.name not in exclude:
+                        workspaces.append((entry.stat().st_mtime, entry.name))
+            workspaces.sort(reverse=True)  # most recently used first
+
+            kept = len(exclude)
+            evicted = []
+            for last_used, session_id in workspaces:
+                if now - last_used > self.ttl_seconds or kept >= self.max_workspaces:
+                    self._remove(self.path(session_id))
+                    evicted.append(session_id)
+                else:
+                    kept += 1
+            return evicted
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_workspace_manager():
+    """Process-wide WorkspaceManager shared by every session."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager()
+        return _manager